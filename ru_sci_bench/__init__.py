@@ -1,3 +1,16 @@
-from ru_sci_bench.classification import get_ru_sci_bench_metrics
+from ru_sci_bench.classification import (
+    get_ru_sci_bench_metrics,
+    get_ru_sci_bench_metrics_from_embeddings,
+)
+from ru_sci_bench.embeddings import EmbeddingMatrix, convert_jsonl_to_binary
+from ru_sci_bench.encoding import get_ru_sci_bench_metrics_from_encoder
+from ru_sci_bench.utils import get_metrics_drift
 
-__all__ = ["get_ru_sci_bench_metrics"]
+__all__ = [
+    "get_ru_sci_bench_metrics",
+    "get_ru_sci_bench_metrics_from_embeddings",
+    "get_ru_sci_bench_metrics_from_encoder",
+    "EmbeddingMatrix",
+    "convert_jsonl_to_binary",
+    "get_metrics_drift",
+]
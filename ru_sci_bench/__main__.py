@@ -0,0 +1,5 @@
+import sys
+
+from ru_sci_bench.cli import main
+
+sys.exit(main())
@@ -1,188 +1,383 @@
-import json
-from typing import Union
+import math
+import os
+import tempfile
+import time
+from collections.abc import Mapping
+from typing import Optional, Union
 
 import numpy as np
-import pandas as pd
+from joblib import Parallel, delayed
 from sklearn.metrics import classification_report, f1_score
-from sklearn.model_selection import GridSearchCV
-from sklearn.neighbors import NearestNeighbors
+from sklearn.model_selection import StratifiedKFold
+from sklearn.multiclass import OneVsRestClassifier
 from sklearn.svm import LinearSVC
-
-from ru_sci_bench.utils import DataPaths, load_embeddings_from_jsonl, print_metrics
+from threadpoolctl import threadpool_limits
+
+from ru_sci_bench.embeddings import (
+    EmbeddingMatrix,
+    _get_n_workers,
+    gather_embeddings,
+    load_embeddings,
+    to_embeddings,
+    unify_embeddings,
+)
+from ru_sci_bench.ridge import RIDGE_ALPHAS, fit_ridge_probe, predict_ridge_probe
+from ru_sci_bench.scheduler import get_n_task_workers, run_tasks_in_workers
+from ru_sci_bench.search import (
+    CSLS_K,
+    SEARCH_BACKENDS,
+    SEARCH_MEMORY_BUDGET,
+    build_search_index,
+    cosine_top_k,
+    csls_gold_pair_ranks,
+    gold_pair_ranks,
+    normalize_embeddings,
+    normalize_embeddings_to_file,
+)
+from ru_sci_bench.splits import load_classification_split, load_translation_pairs
+from ru_sci_bench.streaming import stream_classify
+from ru_sci_bench.utils import DataPaths, get_required_paper_ids, parse_metrics, print_metrics
+from ru_sci_bench.validation import check_embeddings
 
 np.random.seed(1)
 
+RECALL_AT = [1, 5, 10, 100]
+RANK_PERCENTILES = [50, 90, 99]
+ANN_SAMPLE_SIZE = 1000
+CS_GRID = np.logspace(-4, 2, 7)
+CLASSIFIERS = ["svm", "svm_ovr", "ridge", "sgd"]
+SEARCHES = ["grid", "halving"]
+HALVING_FACTOR = 3
+
 
 def get_ru_sci_bench_metrics(
-    embeddings_path: str,
+    embeddings_path: Union[str, list[str]],
     metrics: Union[str, list[str]] = "all",
     get_cls_report: bool = False,
     grid_search_cv: bool = False,
     n_jobs: int = -1,
     max_iter: int = 100,
     silent: bool = False,
+    use_cache: bool = True,
+    dtype: str = "float32",
+    on_invalid: str = "raise",
+    n_workers: int = 1,
+    search_backend: str = "exact",
+    search_memory_budget: Optional[int] = None,
+    classifier: str = "svm",
+    search: str = "grid",
+    csls_k: Optional[int] = CSLS_K,
+    data_paths: Optional[DataPaths] = None,
 ) -> dict:
     """Run ruSciBench tasks.
 
     Arguments:
-        embeddings_path -- path to the jsonl with embeddings
+        embeddings_path -- path to the jsonl with embeddings (optionally `.gz` or `.zst` compressed),
+            a glob pattern, a directory or a list of jsonl shards, or path to the directory with
+            embeddings in the binary format (see `load_embeddings`)
         metrics -- metric or list of metrics to calculate (ru_, en_, full_ classification
             tasks or translation_search) or 'all'
         get_cls_report -- if True, will return classification_report in classification tasks
         grid_search_cv -- if True, will use cross-validation to choose regularization parameter C
             in the classification tasks
-        n_jobs -- number of jobs to run in parallel in GridSearchCV (classification)
-            or NearestNeighbors (translation_search)
+        n_jobs -- number of jobs to parse the jsonl files and cross-validate C, or BLAS threads
+            in translation_search
         max_iter -- maximum number of iterations to fit LinearSVC model (classification)
         silent -- silent all outputs
+        use_cache -- if True, the parsed jsonl is cached next to it (see `load_embeddings`)
+        dtype -- dtype to store the embeddings in: 'float64', 'float32' or 'float16'
+        on_invalid -- 'raise', 'zero' or 'mean' for missing or invalid embeddings
+            (see `check_embeddings`)
+        n_workers -- number of worker processes to run the tasks concurrently, -1 means all cores
+            (see `run_tasks_in_workers`)
+        search_backend -- 'exact', 'ivf' (see `approximate_translation_search`) or 'float16'
+            (see `out_of_core_translation_search`) translation search
+        search_memory_budget -- if set, exact translation search runs out of core within this
+            number of bytes (see `out_of_core_translation_search`)
+        classifier -- 'svm' or 'svm_ovr' (see `get_linear_svc`), 'ridge' (see `fit_ridge_probe`)
+            or 'sgd' (see `stream_classify`)
+        search -- 'grid' (see `grid_search`) or 'halving' (see `successive_halving_search`)
+            search of C with grid_search_cv
+        csls_k -- neighbourhood size of `csls_recall@1` (see `csls_gold_pair_ranks`), None to skip it
+        data_paths -- paths to the benchmark data (see `DataPaths`), the packaged data by default
 
     Returns:
-        metrics -- dictionary with macro average F1, weighted average F1 and optionally classification_report
-            for classification tasks and Recall@1 for translation_search task
+        metrics -- dictionary with macro average F1, weighted average F1, optionally
+            classification_report and with grid_search_cv the chosen C and fit time for
+            classification tasks and Recall@{1,5,10,100}, MRR, rank percentiles and CSLS
+            Recall@1 for translation_search task
     """
-    data_paths = DataPaths()
+    data_paths = data_paths or DataPaths()
+    selected_metrics = parse_metrics(metrics)
     if not silent:
         print("Loading embeddings...")
-    embeddings = load_embeddings_from_jsonl(embeddings_path)
+    # the selected papers are passed even with use_cache: load_embeddings ignores them for a
+    # cached file, but parses sharded embeddings (which are never cached) without the others.
+    # The loaded embeddings are not kept here, so that a dict can be freed once it is unified
+    return get_ru_sci_bench_metrics_from_embeddings(
+        load_embeddings(
+            embeddings_path,
+            use_cache=use_cache,
+            n_jobs=n_jobs,
+            paper_ids=get_required_paper_ids(data_paths, selected_metrics),
+            dtype=dtype,
+        ),
+        metrics=selected_metrics,
+        get_cls_report=get_cls_report,
+        grid_search_cv=grid_search_cv,
+        n_jobs=n_jobs,
+        max_iter=max_iter,
+        silent=silent,
+        on_invalid=on_invalid,
+        n_workers=n_workers,
+        search_backend=search_backend,
+        search_memory_budget=search_memory_budget,
+        classifier=classifier,
+        search=search,
+        csls_k=csls_k,
+        data_paths=data_paths,
+    )
+
+
+def get_ru_sci_bench_metrics_from_embeddings(
+    embeddings: Union[Mapping, EmbeddingMatrix, tuple[np.array, np.array]],
+    metrics: Union[str, list[str]] = "all",
+    get_cls_report: bool = False,
+    grid_search_cv: bool = False,
+    n_jobs: int = -1,
+    max_iter: int = 100,
+    silent: bool = False,
+    on_invalid: str = "raise",
+    n_workers: int = 1,
+    search_backend: str = "exact",
+    search_memory_budget: Optional[int] = None,
+    classifier: str = "svm",
+    search: str = "grid",
+    csls_k: Optional[int] = CSLS_K,
+    data_paths: Optional[DataPaths] = None,
+) -> dict:
+    """Run ruSciBench tasks on embeddings that are already in memory, e.g. in a training loop.
 
+    Arguments:
+        embeddings -- (ids, matrix) pair with paper ids and array-like embeddings (one row per id),
+            EmbeddingMatrix or mapping paper id -> vector. NumPy arrays are used without copying,
+            vectors of a mapping are copied once into one matrix shared by all tasks
+        other arguments -- see `get_ru_sci_bench_metrics`
+
+    Returns:
+        metrics -- see `get_ru_sci_bench_metrics`
+    """
+    if search_backend not in SEARCH_BACKENDS:
+        raise ValueError(f"Unknown search_backend: {search_backend}")
+    if classifier not in CLASSIFIERS:
+        raise ValueError(f"Unknown classifier: {classifier}")
+    if search not in SEARCHES:
+        raise ValueError(f"Unknown search: {search}")
+    data_paths = data_paths or DataPaths()
+    selected_metrics = parse_metrics(metrics)
+    paper_ids = get_required_paper_ids(data_paths, selected_metrics)
+    embeddings = check_embeddings(
+        to_embeddings(embeddings),
+        paper_ids,
+        on_invalid=on_invalid,
+        silent=silent,
+        memory_budget=search_memory_budget,
+    )
+    task_kwargs = {
+        "get_cls_report": get_cls_report,
+        "grid_search_cv": grid_search_cv,
+        "n_jobs": n_jobs,
+        "max_iter": max_iter,
+        "silent": silent,
+        "search_backend": search_backend,
+        "search_memory_budget": search_memory_budget,
+        "classifier": classifier,
+        "search": search,
+        "csls_k": csls_k,
+    }
+    tasks = [task for metric in selected_metrics for task in get_metric_tasks(metric)]
+    n_task_workers = get_n_task_workers(n_workers, len(tasks))
     results = {}
+    if n_task_workers == 1:
+        embeddings = unify_embeddings(embeddings, paper_ids)
+        for metric in selected_metrics:
+            results.update(run_metric(metric, embeddings, data_paths, **task_kwargs))
+        return results
 
-    if metrics in ["all", "translation_search"] or "translation_search" in metrics:
-        if not silent:
-            print("Running the eLibrary translation search task...")
-        ru_embs, en_embs = get_embeddings_for_translation_search(
-            embeddings, data_paths.ru_en_translation_test
-        )
+    if not silent:
+        print(f"Running {len(tasks)} tasks on {n_task_workers} workers...")
+    task_kwargs.update(data_paths=data_paths, n_jobs=1, silent=True)
+    worker_results = run_tasks_in_workers(
+        run_task, tasks, embeddings, paper_ids, n_task_workers, **task_kwargs
+    )
+    # the workers unify the embeddings in shared memory, so the ones held here can be freed
+    del embeddings
+    for _, task_results in worker_results:
+        results.update(task_results)
+        for task_name in task_results:
+            print_metrics(task_name, results, silent)
+    return results
 
-        results["ru_en_translation_search"] = translation_search(
-            queries_embs=ru_embs, results_embs=en_embs, n_jobs=n_jobs
-        )
-        print_metrics("ru_en_translation_search", results, silent)
 
-        results["en_ru_translation_search"] = translation_search(
-            queries_embs=en_embs, results_embs=ru_embs, n_jobs=n_jobs
-        )
-        print_metrics("en_ru_translation_search", results, silent)
+def get_metric_tasks(metric: str) -> list[str]:
+    """Names of the independent tasks of one metric from METRICS: translation_search or
+    elibrary_{oecd,grnti}_{language} for a classification metric."""
+    if metric == "translation_search":
+        return [metric]
+    language = metric.split("_")[0]
+    return [f"elibrary_{rubricator}_{language}" for rubricator in ["oecd", "grnti"]]
 
-    if metrics in ["all", "full_classification"] or "full_classification" in metrics:
-        if not silent:
-            print("Running the eLibrary OECD-full task...")
-        X_train, X_test, y_train, y_test = get_X_y_for_classification(
-            embeddings,
-            data_paths.elibrary_oecd_full_train,
-            data_paths.elibrary_oecd_full_test,
-        )
-        results["elibrary_oecd_full"] = classify(
-            X_train,
-            y_train,
-            X_test,
-            y_test,
-            get_cls_report=get_cls_report,
-            grid_search_cv=grid_search_cv,
-            n_jobs=n_jobs,
-            max_iter=max_iter,
-            silent=silent,
-        )
-        print_metrics("elibrary_oecd_full", results, silent)
 
-        if not silent:
-            print("Running the eLibrary GRNTI-full task...")
-        X_train, X_test, y_train, y_test = get_X_y_for_classification(
-            embeddings,
-            data_paths.elibrary_grnti_full_train,
-            data_paths.elibrary_grnti_full_test,
-        )
-        results["elibrary_grnti_full"] = classify(
-            X_train,
-            y_train,
-            X_test,
-            y_test,
-            get_cls_report=get_cls_report,
-            grid_search_cv=grid_search_cv,
-            n_jobs=n_jobs,
-            max_iter=max_iter,
-            silent=silent,
-        )
-        print_metrics("elibrary_grnti_full", results, silent)
+def run_metric(
+    metric: str,
+    embeddings: Mapping,
+    data_paths: DataPaths,
+    get_cls_report: bool = False,
+    grid_search_cv: bool = False,
+    n_jobs: int = -1,
+    max_iter: int = 100,
+    silent: bool = False,
+    search_backend: str = "exact",
+    search_memory_budget: Optional[int] = None,
+    classifier: str = "svm",
+    search: str = "grid",
+    csls_k: Optional[int] = CSLS_K,
+) -> dict:
+    """Run the tasks of one metric from METRICS.
 
-    if metrics in ["all", "ru_classification"] or "ru_classification" in metrics:
-        if not silent:
-            print("Running the eLibrary OECD-ru task...")
-        X_train, X_test, y_train, y_test = get_X_y_for_classification(
-            embeddings,
-            data_paths.elibrary_oecd_ru_train,
-            data_paths.elibrary_oecd_ru_test,
-        )
-        if not silent:
-            print("Classifier training...")
-        results["elibrary_oecd_ru"] = classify(
-            X_train,
-            y_train,
-            X_test,
-            y_test,
-            get_cls_report=get_cls_report,
-            grid_search_cv=grid_search_cv,
-            n_jobs=n_jobs,
-            max_iter=max_iter,
-            silent=silent,
-        )
-        print_metrics("elibrary_oecd_ru", results, silent)
+    Arguments:
+        metric -- translation_search or ru_, en_, full_ classification
+        embeddings -- EmbeddingMatrix or embeddings dict
+        data_paths -- paths to the benchmark data
+        other arguments -- see `get_ru_sci_bench_metrics`
 
-        if not silent:
-            print("Running the eLibrary GRNTI-ru task...")
-        X_train, X_test, y_train, y_test = get_X_y_for_classification(
+    Returns:
+        metrics -- dictionary task name -> task metrics
+    """
+    results = {}
+    for task in get_metric_tasks(metric):
+        task_results = run_task(
+            task,
             embeddings,
-            data_paths.elibrary_grnti_ru_train,
-            data_paths.elibrary_grnti_ru_test,
-        )
-        if not silent:
-            print("Classifier training...")
-        results["elibrary_grnti_ru"] = classify(
-            X_train,
-            y_train,
-            X_test,
-            y_test,
+            data_paths,
             get_cls_report=get_cls_report,
             grid_search_cv=grid_search_cv,
             n_jobs=n_jobs,
             max_iter=max_iter,
             silent=silent,
+            search_backend=search_backend,
+            search_memory_budget=search_memory_budget,
+            classifier=classifier,
+            search=search,
+            csls_k=csls_k,
         )
-        print_metrics("elibrary_grnti_ru", results, silent)
+        results.update(task_results)
+        for task_name in task_results:
+            print_metrics(task_name, results, silent)
+    return results
 
-    if metrics in ["all", "en_classification"] or "en_classification" in metrics:
-        if not silent:
-            print("Running the eLibrary OECD-en task...")
-        X_train, X_test, y_train, y_test = get_X_y_for_classification(
-            embeddings,
-            data_paths.elibrary_oecd_en_train,
-            data_paths.elibrary_oecd_en_test,
-        )
-        if not silent:
-            print("Classifier training...")
-        results["elibrary_oecd_en"] = classify(
-            X_train,
-            y_train,
-            X_test,
-            y_test,
-            get_cls_report=get_cls_report,
-            grid_search_cv=grid_search_cv,
-            n_jobs=n_jobs,
-            max_iter=max_iter,
-            silent=silent,
-        )
-        print_metrics("elibrary_oecd_en", results, silent)
 
+def run_task(
+    task: str,
+    embeddings: Mapping,
+    data_paths: DataPaths,
+    get_cls_report: bool = False,
+    grid_search_cv: bool = False,
+    n_jobs: int = -1,
+    max_iter: int = 100,
+    silent: bool = False,
+    search_backend: str = "exact",
+    search_memory_budget: Optional[int] = None,
+    classifier: str = "svm",
+    search: str = "grid",
+    csls_k: Optional[int] = CSLS_K,
+) -> dict:
+    """Run one task (see `get_metric_tasks`).
+
+    Arguments:
+        task -- translation_search or elibrary_{oecd,grnti}_{ru,en,full}
+        embeddings -- EmbeddingMatrix or embeddings dict
+        data_paths -- paths to the benchmark data
+        other arguments -- see `get_ru_sci_bench_metrics`
+
+    Returns:
+        metrics -- dictionary task name -> task metrics (both search directions
+            for translation_search)
+    """
+    if task == "translation_search":
         if not silent:
-            print("Running the eLibrary GRNTI-en task...")
-        X_train, X_test, y_train, y_test = get_X_y_for_classification(
-            embeddings,
-            data_paths.elibrary_grnti_en_train,
-            data_paths.elibrary_grnti_en_test,
+            print("Running the eLibrary translation search task...")
+        if search_backend == "float16" or (
+            search_backend == "exact" and search_memory_budget is not None
+        ):
+            ru_en_search, en_ru_search = out_of_core_translation_search(
+                embeddings,
+                data_paths.ru_en_translation_test,
+                n_jobs=n_jobs,
+                memory_budget=search_memory_budget or SEARCH_MEMORY_BUDGET,
+                csls_k=csls_k,
+                dtype=np.float16 if search_backend == "float16" else None,
+            )
+            return {
+                "ru_en_translation_search": ru_en_search,
+                "en_ru_translation_search": en_ru_search,
+            }
+
+        ru_embs, en_embs = get_embeddings_for_translation_search(
+            embeddings, data_paths.ru_en_translation_test
         )
+        memory_budget = search_memory_budget or SEARCH_MEMORY_BUDGET
+        if search_backend == "exact":
+            ru_en_search, en_ru_search = bidirectional_translation_search(
+                ru_embs, en_embs, n_jobs=n_jobs, memory_budget=memory_budget, csls_k=csls_k
+            )
+        else:
+            ru_en_search = approximate_translation_search(
+                ru_embs,
+                en_embs,
+                search_backend=search_backend,
+                n_jobs=n_jobs,
+                memory_budget=memory_budget,
+            )
+            en_ru_search = approximate_translation_search(
+                en_embs,
+                ru_embs,
+                search_backend=search_backend,
+                n_jobs=n_jobs,
+                memory_budget=memory_budget,
+            )
+        return {"ru_en_translation_search": ru_en_search, "en_ru_translation_search": en_ru_search}
+
+    _, rubricator, language = task.split("_")
+    if not silent:
+        print(f"Running the eLibrary {rubricator.upper()}-{language} task...")
+    if classifier == "sgd":
+        # the training rows are streamed from the embeddings instead of gathered at once
+        train_ids, y_train = load_classification_split(getattr(data_paths, f"{task}_train"))
+        test_ids, y_test = load_classification_split(getattr(data_paths, f"{task}_test"))
         if not silent:
             print("Classifier training...")
-        results["elibrary_grnti_en"] = classify(
+        return {
+            task: stream_classify(
+                embeddings,
+                train_ids,
+                y_train,
+                test_ids,
+                y_test,
+                get_cls_report=get_cls_report,
+                silent=silent,
+            )
+        }
+
+    X_train, X_test, y_train, y_test = get_X_y_for_classification(
+        embeddings,
+        getattr(data_paths, f"{task}_train"),
+        getattr(data_paths, f"{task}_test"),
+    )
+    if not silent:
+        print("Classifier training...")
+    return {
+        task: classify(
             X_train,
             y_train,
             X_test,
@@ -192,10 +387,10 @@ def get_ru_sci_bench_metrics(
             n_jobs=n_jobs,
             max_iter=max_iter,
             silent=silent,
+            classifier=classifier,
+            search=search,
         )
-        print_metrics("elibrary_grnti_en", results, silent)
-
-    return results
+    }
 
 
 def classify(
@@ -208,106 +403,521 @@ def classify(
     max_iter: int = 100,
     get_cls_report: bool = False,
     silent: bool = False,
+    classifier: str = "svm",
+    search: str = "grid",
 ) -> dict:
     """
     Simple classification method using sklearn framework. LinearSVC model fits with default parameters.
-        Optionally regularization parameter C can be chosen via cross-validation on X_train, y_train.
+        Optionally regularization parameter C can be chosen via cross-validation on X_train, y_train
+        (see `grid_search`).
 
     Arguments:
         X_train, y_train -- training data
         X_test, y_test -- test data to evaluate on
         grid_search_cv -- if True, will use cross-validation to choose regularization parameter
             C in classification tasks
-        n_jobs -- number of jobs to run in parallel in GridSearchCV
+        n_jobs -- number of jobs to run in parallel in the cross-validation and, for
+            the 'svm_ovr' classifier, in the per-class training
         max_iter -- maximum number of iterations to fit LinearSVC model
         get_cls_report -- return classification_report
+        classifier -- 'svm' or 'svm_ovr' (see `get_linear_svc`), or 'ridge' (see `fit_ridge_probe`;
+            alpha is chosen by leave-one-out accuracy with grid_search_cv, 1.0 otherwise)
+        search -- 'grid' (see `grid_search`) or 'halving'
+            (see `successive_halving_search`) search of C with grid_search_cv
 
     Returns:
         metrics -- dict with macro average F1, weighted average F1 and optionally classification_report
-            on X_test, y_test
+            on X_test, y_test, and with grid_search_cv for LinearSVC the chosen C and the fit time
+            of the search and the final model in seconds
     """
-    estimator = LinearSVC(loss="squared_hinge", max_iter=max_iter, random_state=42)
-    if grid_search_cv:
-        svm = GridSearchCV(
-            estimator=estimator,
-            cv=3,
-            param_grid={"C": np.logspace(-4, 2, 7)},
-            verbose=not silent,
-            n_jobs=n_jobs,
-        )
+    search_result = {}
+    if classifier == "ridge":
+        probe = fit_ridge_probe(X_train, y_train, RIDGE_ALPHAS if grid_search_cv else [1.0])
+        alpha_index = int(np.argmax(probe["loo_accuracy"]))
+        if grid_search_cv and not silent:
+            print(
+                f"Best alpha: {probe['alphas'][alpha_index]} "
+                f"(leave-one-out accuracy {probe['loo_accuracy'][alpha_index]:.4f})"
+            )
+        y_pred = predict_ridge_probe(probe, X_test, alpha_index)
     else:
-        svm = estimator
-    svm.fit(X_train, y_train)
-    y_pred = svm.predict(X_test)
+        start_time = time.perf_counter()
+        if grid_search_cv:
+            search_C = successive_halving_search if search == "halving" else grid_search
+            C = search_C(
+                X_train,
+                y_train,
+                Cs=CS_GRID,
+                max_iter=max_iter,
+                n_jobs=n_jobs,
+                silent=silent,
+                classifier=classifier,
+            )
+        else:
+            C = 1.0
+        svm = get_linear_svc(classifier, C=C, max_iter=max_iter, n_jobs=n_jobs)
+        svm.fit(X_train, y_train)
+        if grid_search_cv:
+            search_result = {"C": float(C), "fit_time": time.perf_counter() - start_time}
+        y_pred = svm.predict(X_test)
     result = {
         "macro_f1": f1_score(y_test, y_pred, average="macro"),
         "weighted_f1": f1_score(y_test, y_pred, average="weighted"),
+        **search_result,
     }
     if get_cls_report:
         result["cls_report"] = classification_report(y_test, y_pred)
     return result
 
 
+def grid_search(
+    X_train: np.array,
+    y_train: np.array,
+    Cs: np.array = CS_GRID,
+    cv: int = 3,
+    max_iter: int = 100,
+    n_jobs: int = -1,
+    silent: bool = False,
+    classifier: str = "svm",
+) -> float:
+    """
+    Choose regularization parameter C of LinearSVC by cross-validated accuracy on a grid,
+        as GridSearchCV(cv=3) does. The fits only receive the row indices of their fold:
+        joblib passes the training data to its worker processes memory-mapped, and every fit
+        copies just its own rows. The fits run in processes rather than threads: liblinear
+        draws its random permutations from one global generator, so concurrent fits in threads
+        would not be reproducible.
+
+    Arguments:
+        X_train, y_train -- training data
+        Cs -- candidate values of C
+        cv -- number of stratified folds
+        max_iter -- maximum number of iterations to fit LinearSVC model
+        n_jobs -- number of fits to run in parallel
+        silent -- silent all outputs
+        classifier -- 'svm' or 'svm_ovr' (see `get_linear_svc`)
+
+    Returns:
+        C -- value with the best mean accuracy over the folds (the smallest one among ties)
+    """
+    Cs = np.sort(Cs)
+    y_train = np.asarray(y_train)
+    folds = list(StratifiedKFold(cv).split(np.empty((len(y_train), 0)), y_train))
+    scores = Parallel(n_jobs=n_jobs)(
+        delayed(_score_linear_svc)(
+            X_train, y_train, *folds[fold], classifier=classifier, C=C, max_iter=max_iter
+        )
+        for C in Cs
+        for fold in range(cv)
+    )
+    mean_scores = np.mean(np.reshape(scores, (len(Cs), cv)), axis=1)
+    best_C = Cs[np.argmax(mean_scores)]
+    if not silent:
+        print(f"Best C: {best_C} (mean accuracy {mean_scores.max():.4f})")
+    return best_C
+
+
+def successive_halving_search(
+    X_train: np.array,
+    y_train: np.array,
+    Cs: np.array = CS_GRID,
+    cv: int = 3,
+    factor: int = HALVING_FACTOR,
+    max_iter: int = 100,
+    n_jobs: int = -1,
+    silent: bool = False,
+    classifier: str = "svm",
+) -> float:
+    """
+    Choose regularization parameter C of LinearSVC by successive halving: all candidates are
+        cross-validated on a stratified subsample of the training data, and the best
+        1 / `factor` of them are promoted to a `factor` times larger subsample until one
+        candidate is left. The subsamples are nested and the last round uses the whole
+        training data, so the clearly bad values of C are only fitted on a fraction of it.
+
+    Arguments:
+        X_train, y_train -- training data
+        Cs -- candidate values of C
+        cv -- number of stratified folds in every round
+        factor -- ratio of the numbers of candidates (and of the subsample sizes) of
+            consecutive rounds
+        max_iter -- maximum number of iterations to fit LinearSVC model
+        n_jobs -- number of fits of a round to run in parallel
+        silent -- silent all outputs
+        classifier -- 'svm' or 'svm_ovr' (see `get_linear_svc`)
+
+    Returns:
+        C -- value with the best mean accuracy over the folds of the last round
+            (the smallest one among ties)
+    """
+    candidates = np.sort(Cs)
+    y_train = np.asarray(y_train)
+    order = _get_stratified_order(y_train)
+    n_rounds = max(1, math.ceil(math.log(len(candidates), factor)))
+    min_samples = cv * len(np.unique(y_train))
+    for round_index in range(n_rounds):
+        n_samples = max(len(order) // factor ** (n_rounds - 1 - round_index), min_samples)
+        subsample = np.sort(order[:n_samples])
+        folds = [
+            (subsample[train], subsample[test])
+            for train, test in StratifiedKFold(cv).split(subsample, y_train[subsample])
+        ]
+        scores = Parallel(n_jobs=n_jobs)(
+            delayed(_score_linear_svc)(
+                X_train, y_train, *folds[fold], classifier=classifier, C=C, max_iter=max_iter
+            )
+            for C in candidates
+            for fold in range(cv)
+        )
+        mean_scores = np.mean(np.reshape(scores, (len(candidates), cv)), axis=1)
+        if not silent:
+            print(
+                f"Round {round_index + 1}: {len(candidates)} values of C on {len(subsample)} "
+                f"samples, best C: {candidates[np.argmax(mean_scores)]} "
+                f"(mean accuracy {mean_scores.max():.4f})"
+            )
+        # a stable sort keeps the smaller C among ties
+        best = np.argsort(-mean_scores, kind="stable")[: math.ceil(len(candidates) / factor)]
+        candidates = candidates[np.sort(best)]
+    return candidates[0]
+
+
+def _get_stratified_order(y: np.array, seed: int = 42) -> np.array:
+    """Random order of the rows in which every prefix has about the class proportions of `y`."""
+    rng = np.random.default_rng(seed)
+    positions = np.empty(len(y), dtype=np.float64)
+    for label in np.unique(y):
+        rows = rng.permutation(np.flatnonzero(y == label))
+        # rows of a class are spread evenly over [0, 1)
+        positions[rows] = (np.arange(len(rows)) + rng.random()) / len(rows)
+    return np.argsort(positions, kind="stable")
+
+
+def get_linear_svc(
+    classifier: str = "svm", C: float = 1.0, max_iter: int = 100, n_jobs: int = 1
+) -> Union[LinearSVC, OneVsRestClassifier]:
+    """
+    LinearSVC model of the classification tasks
+
+    Arguments:
+        classifier -- 'svm' for LinearSVC, whose one-vs-rest binary problems are solved one
+            after another by liblinear, or 'svm_ovr' to solve them in `n_jobs` processes
+            (OneVsRestClassifier): every binary LinearSVC is a clone with the same
+            random_state=42 and reseeds the generator, so the results are reproducible but
+            differ slightly from 'svm', where the classes draw one after another from
+            one random generator
+        C -- regularization parameter
+        max_iter -- maximum number of iterations to fit LinearSVC model
+        n_jobs -- number of processes for 'svm_ovr'
+
+    Returns:
+        unfitted model
+    """
+    svm = LinearSVC(loss="squared_hinge", C=C, max_iter=max_iter, random_state=42)
+    if classifier == "svm":
+        return svm
+    if classifier == "svm_ovr":
+        return OneVsRestClassifier(svm, n_jobs=n_jobs)
+    raise ValueError(f"Unknown classifier: {classifier}")
+
+
+def _score_linear_svc(
+    X: np.array,
+    y: np.array,
+    train: np.array,
+    test: np.array,
+    classifier: str,
+    C: float,
+    max_iter: int,
+) -> float:
+    # the fits of the search are already run in parallel
+    svm = get_linear_svc(classifier, C=C, max_iter=max_iter, n_jobs=1)
+    return svm.fit(X[train], y[train]).score(X[test], y[test])
+
+
 def get_X_y_for_classification(
-    embeddings: dict, train_path: str, test_path: str
+    embeddings: Mapping, train_path: str, test_path: str
 ) -> tuple[np.array, np.array, np.array, np.array]:
     """
     Preparing data for classification task
 
     Arguments:
-        embeddings: embeddings dict
+        embeddings: EmbeddingMatrix or embeddings dict
         train_path: path to the csv with train ids/labels
         test_path: path to the csv with test ids/labels
 
     Returns:
         X_train, X_test, y_train, y_test: train/test embeddings and labels
     """
-    train = pd.read_csv(train_path)
-    test = pd.read_csv(test_path)
-    X_train = train.id.apply(lambda id_: embeddings[id_]).to_list()
-    X_test = test.id.apply(lambda id_: embeddings[id_]).to_list()
-    return np.array(X_train), np.array(X_test), train.label.to_numpy(), test.label.to_numpy()
+    train_ids, y_train = load_classification_split(train_path)
+    test_ids, y_test = load_classification_split(test_path)
+    X_train = gather_embeddings(embeddings, train_ids)
+    X_test = gather_embeddings(embeddings, test_ids)
+    return X_train, X_test, np.asarray(y_train), np.asarray(y_test)
 
 
 def get_embeddings_for_translation_search(
-    embeddings: dict, translation_test_path: str
+    embeddings: Mapping, translation_test_path: str
 ) -> tuple[np.array, np.array]:
     """
     Preparing data for translation_search task
 
     Arguments:
-        embeddings: embeddings dict
+        embeddings: EmbeddingMatrix or embeddings dict
         translation_test_path: path to the russian-english translations file
 
     Returns:
         ru_embs, en_embs: embeddings for texts in russian and english
     """
-    with open(translation_test_path) as f:
-        translation_test = json.load(f)
-    ru_embs = np.array([embeddings[int(id_)] for id_ in translation_test.keys()])
-    en_embs = np.array([embeddings[int(id_)] for id_ in translation_test.values()])
+    ru_ids, en_ids = load_translation_pairs(translation_test_path)
+    ru_embs = gather_embeddings(embeddings, ru_ids)
+    en_embs = gather_embeddings(embeddings, en_ids)
     return ru_embs, en_embs
 
 
 def translation_search(
-    queries_embs: np.array, results_embs: np.array, n_jobs: int = -1
+    queries_embs: np.array,
+    results_embs: np.array,
+    n_jobs: int = -1,
+    memory_budget: int = SEARCH_MEMORY_BUDGET,
 ) -> dict[str, float]:
     """
     Method for checking whether the closest embedding in the dataset to the embedding
         of a text is of its translation. Returns a proportion of texts in the dataset for
-        which it is true.
+        which it is true. The search is exact: cosine similarities are computed by blocks
+        of queries with a matrix product (see `cosine_top_k`).
 
     Arguments:
         queries_embs -- embeddings to use as queries
         results_embs -- embeddings to use for searching
-        n_jobs -- number of jobs to run in parallel in NearestNeighbors
+        n_jobs -- number of BLAS threads to compute the similarities with
+        memory_budget -- maximum size of a block of similarities in bytes
 
     Returns:
         Dictionary with recall@1 metric
     """
-    nearest_neighbor = NearestNeighbors(n_neighbors=1, metric="cosine", n_jobs=n_jobs)
-    nearest_neighbor.fit(results_embs)
-    _, top_index = nearest_neighbor.kneighbors(queries_embs)
+    with threadpool_limits(limits=_get_n_workers(n_jobs), user_api="blas"):
+        top_index, _ = cosine_top_k(queries_embs, results_embs, k=1, memory_budget=memory_budget)
     correct_indexes = np.arange(results_embs.shape[0])
     is_correct = (top_index.flatten() == correct_indexes).nonzero()[0]
     return {"recall@1": is_correct.shape[0] / len(correct_indexes)}
+
+
+def bidirectional_translation_search(
+    ru_embs: np.array,
+    en_embs: np.array,
+    n_jobs: int = -1,
+    memory_budget: int = SEARCH_MEMORY_BUDGET,
+    csls_k: Optional[int] = CSLS_K,
+) -> tuple[dict[str, float], dict[str, float]]:
+    """
+    Translation search in both directions at the cost of one. The rank of the translation
+        of every text is computed in a single pass over the similarity matrix (see
+        `gold_pair_ranks`), and the retrieval metrics are derived from the ranks.
+
+    Arguments:
+        ru_embs, en_embs -- embeddings of the russian texts and of their english translations
+        n_jobs -- number of BLAS threads to compute the similarities with
+        memory_budget -- maximum size of a block of similarities in bytes
+        csls_k -- neighbourhood size of the hubness-corrected CSLS retrieval reported as
+            `csls_recall@1` (see `csls_gold_pair_ranks`), which takes a second pass over
+            the similarity matrix; None to skip it
+
+    Returns:
+        ru_en, en_ru -- dictionaries with retrieval metrics for ru->en and en->ru search
+            (see `get_retrieval_metrics`)
+    """
+    with threadpool_limits(limits=_get_n_workers(n_jobs), user_api="blas"):
+        return _get_translation_search_metrics(
+            *_get_translation_search_ranks(ru_embs, en_embs, memory_budget, csls_k=csls_k)
+        )
+
+
+def out_of_core_translation_search(
+    embeddings: Mapping,
+    translation_test_path: str,
+    n_jobs: int = -1,
+    memory_budget: int = SEARCH_MEMORY_BUDGET,
+    csls_k: Optional[int] = CSLS_K,
+    dtype: Optional[np.dtype] = None,
+) -> tuple[dict[str, float], dict[str, float]]:
+    """
+    Exact translation search in both directions for corpora that do not fit in memory.
+        Normalized embeddings of the russian and english texts are written to temporary
+        `.npy` files, and the ranks of the translations are accumulated over tiles of
+        the memory-mapped files (see `gold_pair_ranks`).
+
+    Arguments:
+        embeddings -- EmbeddingMatrix or embeddings dict
+        translation_test_path -- path to the russian-english translations file
+        n_jobs -- number of BLAS threads to compute the similarities with
+        memory_budget -- maximum size in bytes of a tile of similarities and of the rows
+            it is computed from
+        csls_k -- see `bidirectional_translation_search`
+        dtype -- dtype of the files, the compute dtype of the embeddings by default. With
+            float16 the files take half the space of float32 and are upcast tile by tile,
+            and `recall@1_delta` compares recall@1 with search in the compute dtype on
+            a random sample of ANN_SAMPLE_SIZE queries
+
+    Returns:
+        ru_en, en_ru -- dictionaries with retrieval metrics for ru->en and en->ru search
+            (see `get_retrieval_metrics`)
+    """
+    ru_ids, en_ids = load_translation_pairs(translation_test_path)
+    with tempfile.TemporaryDirectory() as tmp_dir, threadpool_limits(
+        limits=_get_n_workers(n_jobs), user_api="blas"
+    ):
+        ru_embs = normalize_embeddings_to_file(
+            embeddings,
+            ru_ids,
+            os.path.join(tmp_dir, "ru.npy"),
+            memory_budget=memory_budget,
+            dtype=dtype,
+        )
+        en_embs = normalize_embeddings_to_file(
+            embeddings,
+            en_ids,
+            os.path.join(tmp_dir, "en.npy"),
+            memory_budget=memory_budget,
+            dtype=dtype,
+        )
+        ranks = _get_translation_search_ranks(
+            ru_embs, en_embs, memory_budget, out_of_core=True, csls_k=csls_k
+        )
+        del ru_embs, en_embs
+        ru_en, en_ru = _get_translation_search_metrics(*ranks)
+        if dtype is not None:
+            sample = np.sort(
+                np.random.default_rng(0).choice(
+                    len(ru_ids), min(ANN_SAMPLE_SIZE, len(ru_ids)), replace=False
+                )
+            )
+            for metrics, query_ids, result_ids, query_ranks in [
+                (ru_en, ru_ids, en_ids, ranks[0]),
+                (en_ru, en_ids, ru_ids, ranks[1]),
+            ]:
+                top_1 = _stream_top_1(embeddings, query_ids[sample], result_ids, memory_budget)
+                metrics["recall@1_delta"] = float(
+                    np.mean(query_ranks[sample] == 1) - np.mean(top_1 == sample)
+                )
+    return ru_en, en_ru
+
+
+def _stream_top_1(
+    embeddings: Mapping, query_ids: np.array, result_ids: np.array, memory_budget: int
+) -> np.array:
+    """Index of the most similar result of every query (the first one among ties), gathering
+    the results from `embeddings` in blocks that fit in `memory_budget` with their similarities."""
+    queries = normalize_embeddings(gather_embeddings(embeddings, query_ids))
+    dim = queries.shape[1]
+    block_rows = max(1, memory_budget // max(1, 16 * dim + queries.itemsize * len(queries)))
+    best = np.full(len(queries), -np.inf, dtype=queries.dtype)
+    top_1 = np.zeros(len(queries), dtype=np.int64)
+    for start in range(0, len(result_ids), block_rows):
+        block = gather_embeddings(embeddings, result_ids[start : start + block_rows])
+        similarities = queries @ normalize_embeddings(block, queries.dtype).T
+        block_top_1 = similarities.argmax(axis=1)
+        block_best = similarities[np.arange(len(queries)), block_top_1]
+        improved = block_best > best
+        best[improved] = block_best[improved]
+        top_1[improved] = start + block_top_1[improved]
+    return top_1
+
+
+def _get_translation_search_ranks(
+    ru_embs: np.array,
+    en_embs: np.array,
+    memory_budget: int,
+    out_of_core: bool = False,
+    csls_k: Optional[int] = CSLS_K,
+) -> tuple[np.array, np.array, Optional[np.array], Optional[np.array]]:
+    if csls_k is None:
+        ru_ranks, en_ranks = gold_pair_ranks(
+            ru_embs, en_embs, memory_budget=memory_budget, out_of_core=out_of_core
+        )
+        return ru_ranks, en_ranks, None, None
+    return csls_gold_pair_ranks(
+        ru_embs, en_embs, k=csls_k, memory_budget=memory_budget, out_of_core=out_of_core
+    )
+
+
+def _get_translation_search_metrics(
+    ru_ranks: np.array,
+    en_ranks: np.array,
+    ru_csls_ranks: Optional[np.array],
+    en_csls_ranks: Optional[np.array],
+) -> tuple[dict[str, float], dict[str, float]]:
+    ru_en, en_ru = get_retrieval_metrics(ru_ranks), get_retrieval_metrics(en_ranks)
+    if ru_csls_ranks is not None:
+        ru_en["csls_recall@1"] = np.count_nonzero(ru_csls_ranks == 1) / len(ru_csls_ranks)
+        en_ru["csls_recall@1"] = np.count_nonzero(en_csls_ranks == 1) / len(en_csls_ranks)
+    return ru_en, en_ru
+
+
+def get_retrieval_metrics(ranks: np.array, max_rank: Optional[int] = None) -> dict[str, float]:
+    """
+    Retrieval metrics from the ranks of the correct results
+
+    Arguments:
+        ranks -- rank of the correct result for every query, starting from 1
+        max_rank -- if set, ranks are only known up to `max_rank` (larger ranks are misses):
+            MRR is truncated at it and rank percentiles are not reported
+
+    Returns:
+        Dictionary with recall@k for k in RECALL_AT, MRR and percentiles of the rank
+    """
+    metrics = {f"recall@{k}": np.count_nonzero(ranks <= k) / len(ranks) for k in RECALL_AT}
+    if max_rank is None:
+        metrics["mrr"] = float(np.mean(1 / ranks))
+        for q in RANK_PERCENTILES:
+            metrics[f"rank_p{q}"] = float(np.percentile(ranks, q))
+    else:
+        metrics["mrr"] = float(np.mean(np.where(ranks <= max_rank, 1 / ranks, 0)))
+    return metrics
+
+
+def approximate_translation_search(
+    queries_embs: np.array,
+    results_embs: np.array,
+    search_backend: str = "ivf",
+    n_jobs: int = -1,
+    memory_budget: int = SEARCH_MEMORY_BUDGET,
+) -> dict[str, float]:
+    """
+    Translation search with an approximate index. The top max(RECALL_AT) results of every
+        query are retrieved, and the top-1 results of a random sample of ANN_SAMPLE_SIZE
+        queries are compared with exact search to measure the approximation error.
+
+    Arguments:
+        queries_embs -- embeddings to use as queries
+        results_embs -- embeddings to use for searching
+        search_backend -- 'ivf' (see `IVFIndex`)
+        n_jobs -- number of BLAS threads to compute the similarities with
+        memory_budget -- maximum size of a block of similarities in bytes
+
+    Returns:
+        Dictionary with recall@k metrics, MRR truncated at max(RECALL_AT) and, on the sampled
+            queries, `ann_recall@1` -- the share of queries whose approximate top-1 result is
+            the exact one, and `recall@1_delta` -- approximate minus exact recall@1
+    """
+    max_rank = max(RECALL_AT)
+    with threadpool_limits(limits=_get_n_workers(n_jobs), user_api="blas"):
+        index = build_search_index(results_embs, search_backend, memory_budget=memory_budget)
+        top_index, _ = index.search(queries_embs, k=max_rank)
+        sample = np.sort(
+            np.random.default_rng(0).choice(
+                len(queries_embs), min(ANN_SAMPLE_SIZE, len(queries_embs)), replace=False
+            )
+        )
+        exact_top_index, _ = cosine_top_k(
+            queries_embs[sample], results_embs, k=1, memory_budget=memory_budget
+        )
+
+    is_correct = top_index == np.arange(len(top_index))[:, None]
+    ranks = np.where(is_correct.any(axis=1), is_correct.argmax(axis=1) + 1, max_rank + 1)
+    metrics = get_retrieval_metrics(ranks, max_rank=max_rank)
+    metrics["ann_recall@1"] = float(np.mean(top_index[sample, 0] == exact_top_index[:, 0]))
+    metrics["recall@1_delta"] = float(
+        np.mean(top_index[sample, 0] == sample) - np.mean(exact_top_index[:, 0] == sample)
+    )
+    return metrics
@@ -0,0 +1,109 @@
+import argparse
+import sys
+from typing import Optional
+
+from ru_sci_bench.embeddings import (
+    build_embeddings_cache,
+    clear_embeddings_cache,
+    convert_jsonl_to_binary,
+    get_embeddings_cache_path,
+    is_embeddings_cache_valid,
+)
+from ru_sci_bench.splits import SPLITS_CACHE_PATH, compile_split
+from ru_sci_bench.utils import METRICS, DataPaths
+
+DTYPES = ["float64", "float32", "float16"]
+
+
+def cache_command(args: argparse.Namespace) -> int:
+    if args.action == "build":
+        if not args.force and is_embeddings_cache_valid(args.embeddings_path, dtype=args.dtype):
+            print(f"Cache is up to date: {get_embeddings_cache_path(args.embeddings_path)}")
+            return 0
+        cache_path = build_embeddings_cache(args.embeddings_path, args.n_jobs, args.dtype)
+        print(f"Cache written to {cache_path}")
+        return 0
+
+    if args.action == "verify":
+        if is_embeddings_cache_valid(args.embeddings_path, full_check=True):
+            print(f"Cache is valid: {get_embeddings_cache_path(args.embeddings_path)}")
+            return 0
+        print(f"Cache is missing or stale: {get_embeddings_cache_path(args.embeddings_path)}")
+        if args.invalidate and clear_embeddings_cache(args.embeddings_path):
+            print("Stale cache removed")
+        return 1
+
+    if clear_embeddings_cache(args.embeddings_path):
+        print(f"Cache removed: {get_embeddings_cache_path(args.embeddings_path)}")
+    else:
+        print("There is no cache to remove")
+    return 0
+
+
+def convert_command(args: argparse.Namespace) -> int:
+    convert_jsonl_to_binary(args.embeddings_path, args.output_path, args.dtype, args.n_jobs)
+    print(f"Binary embeddings written to {args.output_path}")
+    return 0
+
+
+def splits_command(args: argparse.Namespace) -> int:
+    data_paths = DataPaths(args.data_path)
+    for metric in METRICS:
+        for path in data_paths.get_metric_paths(metric):
+            compile_split(path)
+    print(f"Compiled splits written to {SPLITS_CACHE_PATH}")
+    return 0
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="ru-sci-bench", description="ruSciBench utilities")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    cache_parser = subparsers.add_parser(
+        "cache", help="manage the binary cache of a jsonl file with embeddings"
+    )
+    cache_parser.add_argument("action", choices=["build", "verify", "clear"])
+    cache_parser.add_argument("embeddings_path", help="path to the jsonl with embeddings")
+    cache_parser.add_argument(
+        "--force", action="store_true", help="build: rebuild the cache even if it is up to date"
+    )
+    cache_parser.add_argument(
+        "--invalidate", action="store_true", help="verify: remove the cache if it is stale"
+    )
+    cache_parser.add_argument(
+        "--n-jobs", type=int, default=-1, help="number of processes to parse the file with"
+    )
+    cache_parser.add_argument(
+        "--dtype", choices=DTYPES, default="float32", help="build: dtype of the cached matrix"
+    )
+    cache_parser.set_defaults(func=cache_command)
+
+    convert_parser = subparsers.add_parser(
+        "convert", help="convert a jsonl file with embeddings to the binary format"
+    )
+    convert_parser.add_argument("embeddings_path", help="path to the jsonl with embeddings")
+    convert_parser.add_argument("output_path", help="directory to write the binary embeddings to")
+    convert_parser.add_argument(
+        "--n-jobs", type=int, default=-1, help="number of processes to parse the file with"
+    )
+    convert_parser.add_argument(
+        "--dtype", choices=DTYPES, default="float32", help="dtype of the stored matrix"
+    )
+    convert_parser.set_defaults(func=convert_command)
+
+    splits_parser = subparsers.add_parser(
+        "splits",
+        help="compile the benchmark splits to .npy arrays "
+        "(cached in $RU_SCI_BENCH_CACHE, ~/.cache/ru_sci_bench by default)",
+    )
+    splits_parser.add_argument(
+        "--data-path", default=None, help="directory with the benchmark data (the packaged one)"
+    )
+    splits_parser.set_defaults(func=splits_command)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,696 @@
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import warnings
+from collections.abc import Collection, Iterable, Iterator, Mapping
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Optional, Union
+
+import numpy as np
+from tqdm import tqdm
+
+from ru_sci_bench.utils import (
+    get_compute_dtype,
+    get_paper_id,
+    is_compressed,
+    load_embeddings_from_jsonl,
+    open_embeddings_file,
+    resolve_embeddings_paths,
+)
+
+BINARY_IDS_FILE = "ids.npy"
+BINARY_EMBEDDINGS_FILE = "embeddings.npy"
+WRITE_BLOCK_ROWS = 65536
+GATHER_BLOCK_ROWS = 65536
+
+CACHE_SUFFIX = ".cache"
+CACHE_META_FILE = "cache_meta.json"
+HASH_SAMPLE_BYTES = 1 << 20
+HASH_BLOCK_BYTES = 1 << 24
+
+CHUNKS_PER_JOB = 4
+MAX_CHUNK_BYTES = 1 << 26
+SHARED_MEMORY_DIR = "/dev/shm"
+
+
+class EmbeddingMatrix(Mapping):
+    """Paper embeddings kept in a single 2-D array with an index of paper ids.
+
+    Behaves like the dictionary returned by `load_embeddings_from_jsonl` (paper id -> vector),
+    but all vectors live in one contiguous, possibly memory-mapped, array.
+
+    Arguments:
+        ids -- paper ids, one per row of `vectors`
+        vectors -- 2-D array with embeddings
+        dtype -- dtype of the embeddings if `vectors` is stored in a wider one; rows are
+            converted to it when they are read, so a memory-mapped matrix stays on disk
+    """
+
+    def __init__(self, ids: np.array, vectors: np.array, dtype: Optional[np.dtype] = None) -> None:
+        ids = np.asarray(ids, dtype=np.int64)
+        if not isinstance(vectors, np.ndarray):
+            vectors = np.asarray(vectors)
+        if vectors.ndim != 2 or vectors.shape[0] != ids.shape[0]:
+            raise ValueError(
+                f"Expected a 2-D array with {ids.shape[0]} rows, got shape {vectors.shape}"
+            )
+        self.ids = ids
+        self.vectors = vectors
+        self._dtype = vectors.dtype if dtype is None else np.dtype(dtype)
+        if np.all(ids[1:] > ids[:-1]):
+            self._sorter = None
+            self._sorted_ids = ids
+        else:
+            self._sorter = np.argsort(ids, kind="stable")
+            self._sorted_ids = ids[self._sorter]
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._dtype
+
+    def _search(self, ids: np.array) -> tuple[np.array, np.array]:
+        sorted_ids = self._sorted_ids
+        positions = np.searchsorted(sorted_ids, ids)
+        positions[positions == len(sorted_ids)] = 0
+        found = sorted_ids[positions] == ids if len(sorted_ids) else np.zeros(ids.shape, bool)
+        return positions, found
+
+    def isin(self, ids: Iterable[int]) -> np.array:
+        """Boolean mask of the given paper ids that have embeddings."""
+        return self._search(np.asarray(ids, dtype=np.int64))[1]
+
+    def rows(self, ids: Iterable[int]) -> np.array:
+        """Map paper ids to row numbers in `vectors`, raising KeyError for unknown ids."""
+        ids = np.asarray(ids, dtype=np.int64)
+        positions, found = self._search(ids)
+        if not np.all(found):
+            raise KeyError(int(ids[~found][0]))
+        return positions if self._sorter is None else self._sorter[positions]
+
+    def take(self, ids: Iterable[int], dtype: Optional[np.dtype] = None) -> np.array:
+        """Embeddings of the given papers as a 2-D array, gathered in one vectorized call.
+        If `dtype` differs from the stored one, rows are converted block by block."""
+        rows = self.rows(ids)
+        dtype = self.dtype if dtype is None else np.dtype(dtype)
+        if dtype == self.dtype == self.vectors.dtype:
+            return np.asarray(np.take(self.vectors, rows, axis=0))
+        result = np.empty((len(rows), self.dim), dtype=dtype)
+        for start in range(0, len(rows), GATHER_BLOCK_ROWS):
+            block = np.take(self.vectors, rows[start : start + GATHER_BLOCK_ROWS], axis=0)
+            result[start : start + len(block)] = block.astype(self.dtype, copy=False)
+        return result
+
+    def __getitem__(self, id_: int) -> np.array:
+        return self.vectors[self.rows([id_])[0]].astype(self.dtype, copy=False)
+
+    def __contains__(self, id_: object) -> bool:
+        try:
+            self.rows([id_])
+        except (KeyError, TypeError, ValueError):
+            return False
+        return True
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.ids.tolist())
+
+    def __len__(self) -> int:
+        return self.ids.shape[0]
+
+
+def to_embeddings(
+    embeddings: Union[Mapping, EmbeddingMatrix, tuple[np.array, np.array]],
+) -> Mapping:
+    """Bring in-memory embeddings to a form accepted by the benchmark tasks.
+
+    Arguments:
+        embeddings -- (ids, matrix) pair, EmbeddingMatrix or mapping paper id -> vector
+
+    Returns:
+        embeddings -- EmbeddingMatrix for an (ids, matrix) pair, which shares memory with
+            the matrix if it is a NumPy array (or exposes the array interface), otherwise
+            `embeddings` itself
+    """
+    if isinstance(embeddings, tuple):
+        ids, vectors = embeddings
+        return EmbeddingMatrix(ids, vectors)
+    return embeddings
+
+
+def unify_embeddings(embeddings: Mapping, paper_ids: np.array) -> EmbeddingMatrix:
+    """Put embeddings of the required papers into one matrix, so that a paper used by several
+    tasks is stored once and every task gathers its rows from it by index.
+
+    Arguments:
+        embeddings -- EmbeddingMatrix or dictionary paper id -> vector
+        paper_ids -- sorted unique ids of the papers used by the tasks
+
+    Returns:
+        embeddings -- `embeddings` itself if it is an EmbeddingMatrix (its rows are stored once
+            already), otherwise an EmbeddingMatrix with one row per id from `paper_ids`
+    """
+    if isinstance(embeddings, EmbeddingMatrix):
+        return embeddings
+    paper_ids = np.asarray(paper_ids, dtype=np.int64)
+    first = np.asarray(embeddings[paper_ids[0]]) if len(paper_ids) else np.empty(0)
+    vectors = np.empty((len(paper_ids), len(first)), dtype=first.dtype)
+    for i, id_ in enumerate(paper_ids.tolist()):
+        vectors[i] = embeddings[id_]
+    return EmbeddingMatrix(paper_ids, vectors)
+
+
+def gather_embeddings(embeddings: Mapping, ids: Iterable[int]) -> np.array:
+    """Stack embeddings of the given papers into a 2-D array. Half precision embeddings
+    are upcast to float32 (see `get_compute_dtype`).
+
+    Arguments:
+        embeddings -- EmbeddingMatrix or dictionary paper id -> vector
+        ids -- paper ids
+
+    Returns:
+        2-D array with one row per id
+    """
+    if isinstance(embeddings, EmbeddingMatrix):
+        return embeddings.take(ids, dtype=get_compute_dtype(embeddings.dtype))
+    rows = [embeddings[id_] for id_ in np.asarray(ids).tolist()]
+    return np.array(rows, dtype=get_compute_dtype(rows[0].dtype) if rows else None)
+
+
+def is_binary_embeddings(path: str) -> bool:
+    """Check whether `path` is a directory written by `save_embeddings_to_binary`."""
+    return os.path.isfile(os.path.join(path, BINARY_IDS_FILE)) and os.path.isfile(
+        os.path.join(path, BINARY_EMBEDDINGS_FILE)
+    )
+
+
+def save_embeddings_to_binary(
+    embeddings: Union[Mapping, EmbeddingMatrix],
+    output_path: str,
+    dtype: np.dtype = np.float32,
+) -> None:
+    """Save embeddings in the binary format: a directory with a sorted int64 id column
+    (`ids.npy`) and a contiguous matrix with one row per id (`embeddings.npy`).
+
+    Arguments:
+        embeddings -- dictionary paper id -> vector or EmbeddingMatrix
+        output_path -- directory to write the files to
+        dtype -- dtype of the stored matrix
+    """
+    os.makedirs(output_path, exist_ok=True)
+    if not isinstance(embeddings, EmbeddingMatrix):
+        ids = np.array(sorted(embeddings), dtype=np.int64)
+        dim = len(embeddings[ids[0]]) if len(ids) else 0
+        embeddings = EmbeddingMatrix(
+            ids, np.array([embeddings[id_] for id_ in ids.tolist()], dtype=dtype).reshape(-1, dim)
+        )
+    order = np.argsort(embeddings.ids, kind="stable")
+
+    vectors = np.lib.format.open_memmap(
+        os.path.join(output_path, BINARY_EMBEDDINGS_FILE),
+        mode="w+",
+        dtype=dtype,
+        shape=embeddings.vectors.shape,
+    )
+    for start in range(0, len(order), WRITE_BLOCK_ROWS):
+        block = order[start : start + WRITE_BLOCK_ROWS]
+        vectors[start : start + len(block)] = embeddings.vectors[block].astype(
+            embeddings.dtype, copy=False
+        )
+    vectors.flush()
+    del vectors
+    ids = embeddings.ids[order]
+    np.save(os.path.join(output_path, BINARY_IDS_FILE), ids)
+
+
+def load_embeddings_from_binary(embeddings_path: str, mmap: bool = True) -> EmbeddingMatrix:
+    """Load embeddings saved by `save_embeddings_to_binary`.
+
+    Arguments:
+        embeddings_path -- directory with `ids.npy` and `embeddings.npy`
+        mmap -- if True, the matrix is memory-mapped instead of being read into memory
+
+    Returns:
+        embeddings -- EmbeddingMatrix with the stored ids and vectors
+    """
+    ids = np.load(os.path.join(embeddings_path, BINARY_IDS_FILE))
+    vectors = np.load(
+        os.path.join(embeddings_path, BINARY_EMBEDDINGS_FILE), mmap_mode="r" if mmap else None
+    )
+    return EmbeddingMatrix(ids, vectors)
+
+
+def convert_jsonl_to_binary(
+    embeddings_path: str, output_path: str, dtype: np.dtype = np.float32, n_jobs: int = 1
+) -> None:
+    """Convert a jsonl file with embeddings (see `load_embeddings_from_jsonl`) to the binary format.
+
+    Arguments:
+        embeddings_path -- path to the jsonl with embeddings
+        output_path -- directory to write the binary embeddings to
+        dtype -- dtype of the stored matrix
+        n_jobs -- number of processes to parse the file with, -1 means using all processors
+    """
+    if n_jobs == 1:
+        embeddings = load_embeddings_from_jsonl(embeddings_path, dtype=dtype)
+    else:
+        embeddings = load_embeddings_from_jsonl_parallel(embeddings_path, n_jobs, dtype)
+    save_embeddings_to_binary(embeddings, output_path, dtype)
+
+
+def _get_n_workers(n_jobs: int) -> int:
+    """Number of processes for `n_jobs` in the sklearn convention (-1 means all cores)."""
+    n_cpus = os.cpu_count() or 1
+    return max(1, n_cpus + 1 + n_jobs if n_jobs < 0 else min(n_jobs, n_cpus))
+
+
+def _get_chunk_offsets(path: str, n_chunks: int) -> list[int]:
+    """Split a file into `n_chunks` byte ranges that start at the beginning of a line."""
+    size = os.path.getsize(path)
+    offsets = [0]
+    with open(path, "rb") as f:
+        for i in range(1, n_chunks):
+            f.seek(max(size * i // n_chunks, offsets[-1]))
+            f.readline()
+            offsets.append(min(f.tell(), size))
+    offsets.append(size)
+    return sorted(set(offsets))
+
+
+def _get_chunks(paths: list[str], n_chunks: int) -> list[tuple[str, int, Optional[int]]]:
+    """Split files into about `n_chunks` parts of similar size. Uncompressed files are split into
+    byte ranges [start, end) at line boundaries, compressed files are read whole (end is None)."""
+    sizes = [os.path.getsize(path) for path in paths]
+    chunk_size = min(max(sum(sizes) // n_chunks, 1), MAX_CHUNK_BYTES)
+    chunks = []
+    for path, size in zip(paths, sizes):
+        if is_compressed(path):
+            chunks.append((path, 0, None))
+            continue
+        offsets = _get_chunk_offsets(path, size // chunk_size + 1)
+        chunks.extend((path, start, end) for start, end in zip(offsets[:-1], offsets[1:]))
+    return chunks
+
+
+_worker_paper_ids: Optional[set[int]] = None
+
+
+def _init_worker(paper_ids: Optional[np.array]) -> None:
+    global _worker_paper_ids
+    _worker_paper_ids = None if paper_ids is None else set(paper_ids.tolist())
+
+
+def _stream_lines(path: str) -> Iterator[bytes]:
+    with open_embeddings_file(path) as f:
+        yield from f
+
+
+def _read_chunk_lines(path: str, start: int, end: Optional[int]) -> Iterator[bytes]:
+    """Lines in the byte range [start, end) of a file (the whole decompressed file if `end`
+    is None), except the lines with papers that are not in the whitelist of the worker."""
+    if end is None:
+        lines = _stream_lines(path)
+    else:
+        with open(path, "rb") as f:
+            f.seek(start)
+            lines = f.read(end - start).splitlines()
+    if _worker_paper_ids is None:
+        return iter(lines)
+    return (line for line in lines if get_paper_id(line) in _worker_paper_ids)
+
+
+def _count_lines(path: str, start: int, end: int) -> int:
+    if _worker_paper_ids is not None:
+        return sum(1 for _ in _read_chunk_lines(path, start, end))
+    n_lines = 0
+    last_byte = b"\n"
+    with open(path, "rb") as f:
+        f.seek(start)
+        while start < end:
+            block = f.read(min(HASH_BLOCK_BYTES, end - start))
+            if not block:
+                break
+            n_lines += block.count(b"\n")
+            last_byte = block[-1:]
+            start += len(block)
+    return n_lines + (last_byte != b"\n")
+
+
+def _parse_jsonl_chunk(
+    path: str,
+    start: int,
+    end: Optional[int],
+    first_row: int,
+    vectors_path: str,
+    shape: tuple[int, int],
+    dtype: np.dtype,
+) -> np.array:
+    """Parse lines of a chunk of a jsonl file (see `_read_chunk_lines`), writing embeddings into
+    the rows of the shared matrix starting from `first_row`. Returns the parsed paper ids."""
+    vectors = np.memmap(vectors_path, dtype=dtype, mode="r+", shape=shape)
+    ids = []
+    for paper_id, embedding in _iter_parsed_lines(path, start, end, shape[1]):
+        vectors[first_row + len(ids)] = embedding
+        ids.append(paper_id)
+    vectors.flush()
+    return np.array(ids, dtype=np.int64)
+
+
+def _parse_jsonl_stream(path: str, part_path: str, dim: int, dtype: np.dtype) -> np.array:
+    """Parse a whole (compressed) jsonl file in a single pass, as its number of lines is not
+    known in advance: embeddings are appended to the raw file `part_path` block by block.
+    Returns the parsed paper ids."""
+    ids, block = [], []
+    with open(part_path, "wb") as part:
+        for paper_id, embedding in _iter_parsed_lines(path, 0, None, dim):
+            ids.append(paper_id)
+            block.append(embedding)
+            if len(block) == WRITE_BLOCK_ROWS:
+                part.write(np.array(block, dtype=dtype).tobytes())
+                block = []
+        part.write(np.array(block, dtype=dtype).reshape(-1, dim).tobytes())
+    return np.array(ids, dtype=np.int64)
+
+
+def _iter_parsed_lines(
+    path: str, start: int, end: Optional[int], dim: int
+) -> Iterator[tuple[int, list[float]]]:
+    """(paper id, embedding) of the lines of a chunk (see `_read_chunk_lines`), checking
+    the dimension of the embeddings."""
+    for line in _read_chunk_lines(path, start, end):
+        line_json = json.loads(line)
+        if len(line_json["embedding"]) != dim:
+            raise ValueError(
+                f"Embedding of paper {line_json['paper_id']} in {path} has dimension "
+                f"{len(line_json['embedding'])}, expected {dim}"
+            )
+        yield line_json["paper_id"], line_json["embedding"]
+
+
+def _get_embeddings_dim(paths: list[str]) -> int:
+    for path in paths:
+        for line in _stream_lines(path):
+            if line.strip():
+                return len(json.loads(line)["embedding"])
+    return 0
+
+
+def load_embeddings_from_jsonl_parallel(
+    embeddings_path: Union[str, list[str]],
+    n_jobs: int = -1,
+    dtype: np.dtype = np.float32,
+    paper_ids: Optional[Collection[int]] = None,
+) -> EmbeddingMatrix:
+    """Load embeddings from jsonl files (see `load_embeddings_from_jsonl`) in several processes.
+
+    Uncompressed files are split into chunks at line boundaries, compressed shards are
+    decompressed on the fly as a whole. The chunks are parsed in a process pool and each process
+    writes its embeddings directly into its rows of one preallocated matrix, shared via
+    a memory-mapped file (see `create_shared_file`). The lines of uncompressed chunks are
+    counted beforehand to place their rows, while compressed shards are decompressed only once:
+    they are parsed into temporary files that are copied into the matrix afterwards.
+    As in `load_embeddings_from_jsonl`, the last embedding of a repeated paper id is kept.
+
+    Arguments:
+        embeddings_path -- path to the embeddings file, a glob pattern, a directory with shards
+            or a list of those (see `resolve_embeddings_paths`)
+        n_jobs -- number of processes, -1 means using all processors
+        dtype -- dtype of the embeddings matrix
+        paper_ids -- if given, only embeddings of these papers are loaded, other lines
+            are skipped before being decoded
+
+    Returns:
+        embeddings -- EmbeddingMatrix with the paper ids and embeddings
+    """
+    paths = resolve_embeddings_paths(embeddings_path)
+    dim = _get_embeddings_dim(paths)
+    n_workers = _get_n_workers(n_jobs)
+    chunks = _get_chunks(paths, n_workers * CHUNKS_PER_JOB)
+    if paper_ids is not None:
+        paper_ids = np.asarray(paper_ids, dtype=np.int64)
+    with ProcessPoolExecutor(
+        n_workers, initializer=_init_worker, initargs=(paper_ids,)
+    ) as pool, tempfile.TemporaryDirectory() as parts_dir, tqdm(
+        total=len(chunks), desc="reading embeddings from file...", unit="chunk"
+    ) as progress:
+        part_paths = {
+            i: os.path.join(parts_dir, f"{i}.bin")
+            for i, chunk in enumerate(chunks)
+            if chunk[2] is None
+        }
+        # compressed shards are parsed while the lines of the other chunks are counted
+        futures = [
+            (
+                pool.submit(_parse_jsonl_stream, chunk[0], part_paths[i], dim, dtype)
+                if i in part_paths
+                else pool.submit(_count_lines, *chunk)
+            )
+            for i, chunk in enumerate(chunks)
+        ]
+        ids = {}
+        for i in part_paths:
+            ids[i] = futures[i].result()
+            progress.update()
+        n_lines = [len(ids[i]) if i in ids else futures[i].result() for i in range(len(chunks))]
+        first_rows = np.cumsum([0] + n_lines).tolist()
+        shape = (first_rows[-1], dim)
+        if shape[0] == 0:
+            return EmbeddingMatrix(np.empty(0, np.int64), np.empty(shape, dtype))
+        with create_shared_file(shape[0] * dim * np.dtype(dtype).itemsize) as tmp:
+            vectors = np.memmap(tmp.name, dtype=dtype, mode="r+", shape=shape)
+            futures = {
+                i: pool.submit(_parse_jsonl_chunk, *chunk, first_rows[i], tmp.name, shape, dtype)
+                for i, chunk in enumerate(chunks)
+                if i not in part_paths
+            }
+            for i, part_path in part_paths.items():
+                if n_lines[i]:
+                    part = np.memmap(part_path, dtype=dtype, mode="r", shape=(n_lines[i], dim))
+                    for start in range(0, n_lines[i], WRITE_BLOCK_ROWS):
+                        block = part[start : start + WRITE_BLOCK_ROWS]
+                        vectors[first_rows[i] + start : first_rows[i] + start + len(block)] = block
+                    del part
+                os.remove(part_path)
+            for i, future in futures.items():
+                ids[i] = future.result()
+                progress.update()
+    return _drop_repeated_ids(np.concatenate([ids[i] for i in range(len(chunks))]), vectors)
+
+
+def _drop_repeated_ids(ids: np.array, vectors: np.array) -> EmbeddingMatrix:
+    """EmbeddingMatrix with the last row of every repeated paper id. The kept rows are moved
+    to the front of `vectors` in place, block by block, so that no copy is made."""
+    _, last_reversed = np.unique(ids[::-1], return_index=True)
+    keep = np.sort(len(ids) - 1 - last_reversed)
+    if len(keep) == len(ids):
+        return EmbeddingMatrix(ids, vectors)
+    # keep[i] >= i, so the rows of a block are read before they can be overwritten
+    for start in range(0, len(keep), GATHER_BLOCK_ROWS):
+        block = keep[start : start + GATHER_BLOCK_ROWS]
+        vectors[start : start + len(block)] = vectors[block]
+    return EmbeddingMatrix(ids[keep], vectors[: len(keep)])
+
+
+def create_shared_file(n_bytes: int) -> IO[bytes]:
+    """Temporary file of `n_bytes` bytes to share an array between processes with np.memmap.
+
+    It is created in /dev/shm when the space can be allocated there, and in TMPDIR otherwise.
+    The space is allocated upfront: writing to a sparse file that does not fit in a tmpfs
+    kills the processes with SIGBUS.
+    """
+    if os.path.isdir(SHARED_MEMORY_DIR):
+        tmp = tempfile.NamedTemporaryFile(dir=SHARED_MEMORY_DIR)
+        try:
+            _allocate_file(tmp, n_bytes)
+            return tmp
+        except OSError as e:
+            tmp.close()
+            if e.errno != errno.ENOSPC:
+                raise
+    tmp = tempfile.NamedTemporaryFile()
+    _allocate_file(tmp, n_bytes)
+    return tmp
+
+
+def _allocate_file(f: IO[bytes], n_bytes: int) -> None:
+    if n_bytes == 0:
+        return
+    try:
+        os.posix_fallocate(f.fileno(), 0, n_bytes)
+    except OSError as e:
+        if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+            raise
+        f.truncate(n_bytes)
+
+
+def _hash_file(path: str, sample: bool) -> str:
+    """blake2b of the whole file or, if `sample` is True, of its first and last megabyte."""
+    digest = hashlib.blake2b(digest_size=16)
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        if sample and size > 2 * HASH_SAMPLE_BYTES:
+            digest.update(f.read(HASH_SAMPLE_BYTES))
+            f.seek(size - HASH_SAMPLE_BYTES)
+            digest.update(f.read(HASH_SAMPLE_BYTES))
+        else:
+            for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _file_fingerprint(path: str) -> dict:
+    stat = os.stat(path)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sample_hash": _hash_file(path, sample=True),
+    }
+
+
+def get_embeddings_cache_path(embeddings_path: str) -> str:
+    """Path of the binary cache kept next to a jsonl file with embeddings."""
+    return embeddings_path + CACHE_SUFFIX
+
+
+def build_embeddings_cache(
+    embeddings_path: str, n_jobs: int = 1, dtype: np.dtype = np.float32
+) -> str:
+    """Parse a jsonl file with embeddings and save it as a binary cache next to it.
+
+    The cache is a directory in the binary format (see `save_embeddings_to_binary`) with
+    an additional `cache_meta.json`, which stores the size, modification time and content
+    hashes of the jsonl file. If there is an up-to-date cache with a wider dtype,
+    it is converted instead of parsing the file again (`load_embeddings` never does this,
+    it keeps the wider cache and converts the embeddings on load).
+
+    Arguments:
+        embeddings_path -- path to the jsonl with embeddings
+        n_jobs -- number of processes to parse the file with, -1 means using all processors
+        dtype -- dtype of the cached matrix
+
+    Returns:
+        cache_path -- path to the written cache
+    """
+    cache_path = get_embeddings_cache_path(embeddings_path)
+    tmp_path = cache_path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+
+    meta = {}
+    if is_embeddings_cache_valid(embeddings_path):
+        with open(os.path.join(cache_path, CACHE_META_FILE)) as f:
+            meta = json.load(f)
+    if meta and np.can_cast(dtype, meta["dtype"]):
+        save_embeddings_to_binary(load_embeddings_from_binary(cache_path), tmp_path, dtype)
+    else:
+        meta = _file_fingerprint(embeddings_path)
+        if n_jobs == 1:
+            embeddings = load_embeddings_from_jsonl(embeddings_path, dtype=dtype)
+        else:
+            embeddings = load_embeddings_from_jsonl_parallel(embeddings_path, n_jobs, dtype)
+        save_embeddings_to_binary(embeddings, tmp_path, dtype)
+        del embeddings
+        meta["content_hash"] = _hash_file(embeddings_path, sample=False)
+    meta["dtype"] = np.dtype(dtype).name
+    with open(os.path.join(tmp_path, CACHE_META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    clear_embeddings_cache(embeddings_path)
+    os.replace(tmp_path, cache_path)
+    return cache_path
+
+
+def is_embeddings_cache_valid(
+    embeddings_path: str, full_check: bool = False, dtype: Optional[np.dtype] = None
+) -> bool:
+    """Check whether the binary cache of a jsonl file exists and matches the file.
+
+    Arguments:
+        embeddings_path -- path to the jsonl with embeddings
+        full_check -- if True, also compare the hash of the whole file content
+        dtype -- if given, the cache must also be stored in this dtype or a wider one
+            (`load_embeddings` converts it on load)
+
+    Returns:
+        True if the cache can be used instead of the jsonl file
+    """
+    cache_path = get_embeddings_cache_path(embeddings_path)
+    meta_path = os.path.join(cache_path, CACHE_META_FILE)
+    if not (is_binary_embeddings(cache_path) and os.path.isfile(meta_path)):
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    fingerprint = _file_fingerprint(embeddings_path)
+    if any(meta.get(key) != value for key, value in fingerprint.items()):
+        return False
+    if dtype is not None and not np.can_cast(dtype, meta.get("dtype")):
+        return False
+    return not full_check or meta.get("content_hash") == _hash_file(embeddings_path, sample=False)
+
+
+def clear_embeddings_cache(embeddings_path: str) -> bool:
+    """Remove the binary cache of a jsonl file. Returns True if there was one."""
+    cache_path = get_embeddings_cache_path(embeddings_path)
+    if not os.path.isdir(cache_path):
+        return False
+    shutil.rmtree(cache_path)
+    return True
+
+
+def load_embeddings(
+    embeddings_path: Union[str, list[str]],
+    use_cache: bool = True,
+    n_jobs: int = 1,
+    paper_ids: Optional[Collection[int]] = None,
+    dtype: np.dtype = np.float32,
+) -> Mapping:
+    """Load embeddings from jsonl files or from a directory in the binary format.
+
+    Arguments:
+        embeddings_path -- path to the binary embeddings directory, to the jsonl with embeddings
+            (optionally `.gz` or `.zst` compressed), a glob pattern, a directory with jsonl shards
+            or a list of those
+        use_cache -- if True, a single jsonl file is parsed only once: the result is saved as
+            a binary cache next to it (see `build_embeddings_cache`) and reused while the file
+            is unchanged. The cache keeps the widest dtype requested so far: it is rebuilt for
+            a wider dtype, and its rows are converted when read for a narrower one. Sharded embeddings are
+            not cached
+        n_jobs -- number of processes to parse jsonl files with (see
+            `load_embeddings_from_jsonl_parallel`), -1 means using all processors
+        paper_ids -- ids of the papers that are needed; when a jsonl file is parsed without
+            the cache, embeddings of other papers are skipped. The cache always holds the whole
+            file, and binary embeddings are memory-mapped, so only the needed rows are read anyway
+        dtype -- dtype to store the embeddings parsed from a jsonl file in; binary embeddings
+            are used in the dtype they were saved in
+
+    Returns:
+        embeddings -- mapping paper id -> vector
+    """
+    if isinstance(embeddings_path, str) and is_binary_embeddings(embeddings_path):
+        return load_embeddings_from_binary(embeddings_path)
+    paths = resolve_embeddings_paths(embeddings_path)
+    if len(paths) == 1:
+        embeddings_path = paths[0]
+    else:
+        use_cache = False
+    if use_cache and not is_embeddings_cache_valid(embeddings_path, dtype=dtype):
+        try:
+            build_embeddings_cache(embeddings_path, n_jobs, dtype)
+        except OSError as e:
+            warnings.warn(f"Could not write embeddings cache: {e}")
+            use_cache = False
+    if not use_cache:
+        if n_jobs != 1:
+            return load_embeddings_from_jsonl_parallel(paths, n_jobs, dtype, paper_ids)
+        embeddings = {}
+        for path in paths:
+            embeddings.update(load_embeddings_from_jsonl(path, paper_ids, dtype))
+        return embeddings
+    embeddings = load_embeddings_from_binary(get_embeddings_cache_path(embeddings_path))
+    # the cache is never narrowed in place, so that runs in other dtypes keep reusing it;
+    # its rows are converted when the tasks gather them
+    return EmbeddingMatrix(embeddings.ids, embeddings.vectors, dtype=dtype)
@@ -0,0 +1,167 @@
+import threading
+from collections.abc import Callable
+from typing import Optional, Union
+
+import numpy as np
+from tqdm import tqdm
+
+from ru_sci_bench.classification import run_metric
+from ru_sci_bench.embeddings import EmbeddingMatrix
+from ru_sci_bench.search import CSLS_K
+from ru_sci_bench.utils import DataPaths, get_required_paper_ids, parse_metrics
+from ru_sci_bench.validation import check_embeddings
+
+
+class EncodingThread(threading.Thread):
+    """Background thread that computes embeddings of papers batch by batch.
+
+    Arguments:
+        encode -- function returning a 2-D array of embeddings for an array of paper ids
+        ids -- ids of the papers to encode, in the order of encoding
+        batch_size -- number of ids passed to `encode` at once
+        dtype -- dtype of the embeddings matrix
+        silent -- silent the progress bar
+    """
+
+    def __init__(
+        self,
+        encode: Callable[[np.array], np.array],
+        ids: np.array,
+        batch_size: int,
+        dtype: np.dtype,
+        silent: bool = False,
+    ) -> None:
+        super().__init__(daemon=True)
+        self.encode = encode
+        self.ids = ids
+        self.batch_size = batch_size
+        self.dtype = dtype
+        self.silent = silent
+        self.vectors: Optional[np.array] = None
+        self.n_encoded = 0
+        self.error: Optional[BaseException] = None
+        self._condition = threading.Condition()
+
+    def run(self) -> None:
+        try:
+            for start in tqdm(
+                range(0, len(self.ids), self.batch_size),
+                desc="encoding papers...",
+                disable=self.silent,
+            ):
+                batch_ids = self.ids[start : start + self.batch_size]
+                batch = np.asarray(self.encode(batch_ids))
+                if batch.ndim != 2 or batch.shape[0] != len(batch_ids):
+                    raise ValueError(
+                        f"encode returned an array of shape {batch.shape} "
+                        f"for a batch of {len(batch_ids)} ids"
+                    )
+                if self.vectors is None:
+                    self.vectors = np.empty((len(self.ids), batch.shape[1]), dtype=self.dtype)
+                self.vectors[start : start + len(batch_ids)] = batch
+                with self._condition:
+                    self.n_encoded = start + len(batch_ids)
+                    self._condition.notify_all()
+        except BaseException as e:
+            with self._condition:
+                self.error = e
+                self._condition.notify_all()
+
+    def wait_for(self, n_rows: int) -> EmbeddingMatrix:
+        """Block until the first `n_rows` papers are encoded and return their embeddings."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.n_encoded >= n_rows or self.error is not None)
+        if self.error is not None:
+            raise RuntimeError("Encoding of the papers failed") from self.error
+        if self.vectors is None:
+            return EmbeddingMatrix(self.ids[:0], np.empty((0, 0), dtype=self.dtype))
+        return EmbeddingMatrix(self.ids[:n_rows], self.vectors[:n_rows])
+
+
+def get_ru_sci_bench_metrics_from_encoder(
+    encode: Callable[[np.array], np.array],
+    metrics: Union[str, list[str]] = "all",
+    batch_size: int = 256,
+    get_cls_report: bool = False,
+    grid_search_cv: bool = False,
+    n_jobs: int = -1,
+    max_iter: int = 100,
+    silent: bool = False,
+    dtype: str = "float32",
+    on_invalid: str = "raise",
+    search_backend: str = "exact",
+    search_memory_budget: Optional[int] = None,
+    classifier: str = "svm",
+    search: str = "grid",
+    csls_k: Optional[int] = CSLS_K,
+    data_paths: Optional[DataPaths] = None,
+) -> dict:
+    """Run ruSciBench tasks, computing the embeddings with a model on the fly.
+
+    Only the papers used by the selected metrics are encoded. Encoding runs in a background
+    thread in the order of the metrics, and each metric is evaluated as soon as all its papers
+    are encoded, while the papers of the next metrics are still being encoded.
+
+    Arguments:
+        encode -- function returning a 2-D array of embeddings (one row per id) for
+            an array of paper ids
+        metrics -- metric or list of metrics to calculate (see `get_ru_sci_bench_metrics`)
+        batch_size -- number of paper ids passed to `encode` at once
+        dtype -- dtype to store the embeddings in
+        on_invalid -- embeddings of the papers of each metric are checked once they are encoded,
+            before the metric is evaluated (see `get_ru_sci_bench_metrics`)
+        other arguments -- see `get_ru_sci_bench_metrics`
+
+    Returns:
+        metrics -- see `get_ru_sci_bench_metrics`
+    """
+    data_paths = data_paths or DataPaths()
+    selected_metrics = parse_metrics(metrics)
+
+    required_ids = []
+    metric_ids = []
+    encoded_ids = np.empty(0, dtype=np.int64)
+    for metric in selected_metrics:
+        required_ids.append(get_required_paper_ids(data_paths, metric))
+        new_ids = np.setdiff1d(required_ids[-1], encoded_ids, assume_unique=True)
+        metric_ids.append(new_ids)
+        encoded_ids = np.union1d(encoded_ids, new_ids)
+    ends = np.cumsum([len(ids) for ids in metric_ids]).tolist()
+
+    encoder = EncodingThread(
+        encode,
+        np.concatenate([np.empty(0, dtype=np.int64)] + metric_ids),
+        batch_size=batch_size,
+        dtype=dtype,
+        silent=silent,
+    )
+    encoder.start()
+
+    results = {}
+    for metric, paper_ids, end in zip(selected_metrics, required_ids, ends):
+        embeddings = check_embeddings(
+            encoder.wait_for(end),
+            paper_ids,
+            on_invalid=on_invalid,
+            silent=silent,
+            memory_budget=search_memory_budget,
+        )
+        results.update(
+            run_metric(
+                metric,
+                embeddings,
+                data_paths,
+                get_cls_report=get_cls_report,
+                grid_search_cv=grid_search_cv,
+                n_jobs=n_jobs,
+                max_iter=max_iter,
+                silent=silent,
+                search_backend=search_backend,
+                search_memory_budget=search_memory_budget,
+                classifier=classifier,
+                search=search,
+                csls_k=csls_k,
+            )
+        )
+    encoder.join()
+    return results
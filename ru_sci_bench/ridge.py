@@ -0,0 +1,105 @@
+from collections.abc import Iterator
+
+import numpy as np
+
+RIDGE_ALPHAS = np.logspace(-2, 4, 7)
+RIDGE_BLOCK_ROWS = 65536
+
+
+def _iter_centered_blocks(X: np.array, mean: np.array) -> Iterator[tuple[int, np.array]]:
+    """Blocks of rows of `X` minus `mean` in float32."""
+    for start in range(0, len(X), RIDGE_BLOCK_ROWS):
+        block = np.asarray(X[start : start + RIDGE_BLOCK_ROWS], dtype=np.float32)
+        yield start, block - mean.astype(np.float32)
+
+
+def _get_targets(y: np.array, classes: np.array) -> np.array:
+    """One-vs-rest targets: 1 for the class of the row and -1 for the other classes."""
+    targets = np.full((len(y), len(classes)), -1, dtype=np.float32)
+    targets[np.arange(len(y)), np.searchsorted(classes, y)] = 1
+    return targets
+
+
+def fit_ridge_probe(X: np.array, y: np.array, alphas: np.array = RIDGE_ALPHAS) -> dict:
+    """Closed-form one-vs-rest ridge classifiers with an intercept for a grid of alphas.
+
+    The centered Gram matrix XᵀX and XᵀY are accumulated over blocks of rows with float32
+    matrix products (summed in float64), and a single eigendecomposition XᵀX = V diag(λ) Vᵀ
+    gives the weights (XᵀX + αI)⁻¹XᵀY = V diag(1 / (λ + α)) VᵀXᵀY of every alpha.
+    The leave-one-out predictions of every alpha are computed in one more pass from the
+    diagonal of the hat matrix, without refitting. The pass is skipped for a single alpha,
+    as there is nothing to choose from.
+
+    Arguments:
+        X -- training embeddings
+        y -- training labels
+        alphas -- regularization strengths
+
+    Returns:
+        probe -- dictionary with the sorted `classes`, `alphas`, the weights `coef` of shape
+            (n_alphas, dim, n_classes), the `intercept` of shape (n_alphas, n_classes) and
+            the leave-one-out accuracy `loo_accuracy` of every alpha (NaN for a single alpha)
+    """
+    alphas = np.asarray(alphas, dtype=np.float64)
+    classes = np.unique(y)
+    n, dim = X.shape
+
+    mean = np.zeros(dim, dtype=np.float64)
+    for start in range(0, n, RIDGE_BLOCK_ROWS):
+        mean += np.asarray(X[start : start + RIDGE_BLOCK_ROWS], dtype=np.float32).sum(
+            axis=0, dtype=np.float64
+        )
+    mean /= max(n, 1)
+
+    gram = np.zeros((dim, dim), dtype=np.float64)
+    xty = np.zeros((dim, len(classes)), dtype=np.float64)
+    target_sum = np.zeros(len(classes), dtype=np.float64)
+    for start, block in _iter_centered_blocks(X, mean):
+        targets = _get_targets(y[start : start + len(block)], classes)
+        gram += block.T @ block
+        xty += block.T @ targets
+        target_sum += targets.sum(axis=0, dtype=np.float64)
+    target_mean = target_sum / max(n, 1)
+
+    eigenvalues, eigenvectors = np.linalg.eigh(gram)
+    eigenvalues = np.clip(eigenvalues, 0, None)
+    # (n_alphas, dim): diagonal of (diag(λ) + αI)⁻¹ for every alpha
+    inverse = 1 / (eigenvalues[None, :] + alphas[:, None])
+    projected_xty = eigenvectors.T @ xty
+    # weights in the eigenbasis, (n_alphas, dim, n_classes)
+    projected_coef = inverse[:, :, None] * projected_xty[None, :, :]
+    coef = np.einsum("ij,ajk->aik", eigenvectors, projected_coef)
+    intercept = target_mean[None, :] - np.einsum("j,ajk->ak", mean, coef)
+
+    probe = {"classes": classes, "alphas": alphas, "coef": coef, "intercept": intercept}
+    if len(alphas) == 1:
+        probe["loo_accuracy"] = np.full(1, np.nan)
+        return probe
+
+    # leave-one-out residuals are (t - t̂) / (1 - h) with the hat diagonal
+    # h = 1/n + Σ_j z_j² / (λ_j + α), z = (x - mean) V
+    n_correct = np.zeros(len(alphas), dtype=np.int64)
+    eigenvectors32 = eigenvectors.astype(np.float32)
+    for start, block in _iter_centered_blocks(X, mean):
+        labels = np.searchsorted(classes, y[start : start + len(block)])
+        targets = _get_targets(y[start : start + len(block)], classes)
+        z = block @ eigenvectors32
+        hat = 1 / max(n, 1) + (z.astype(np.float64) ** 2) @ inverse.T
+        for i in range(len(alphas)):
+            predictions = z @ projected_coef[i].astype(np.float32) + target_mean
+            loo = targets - (targets - predictions) / (1 - hat[:, i, None])
+            n_correct[i] += np.count_nonzero(loo.argmax(axis=1) == labels)
+
+    probe["loo_accuracy"] = n_correct / max(n, 1)
+    return probe
+
+
+def predict_ridge_probe(probe: dict, X: np.array, alpha_index: int) -> np.array:
+    """Labels predicted by the ridge classifier of one alpha of `fit_ridge_probe`."""
+    coef = probe["coef"][alpha_index].astype(np.float32)
+    predictions = np.empty(len(X), dtype=probe["classes"].dtype)
+    for start in range(0, len(X), RIDGE_BLOCK_ROWS):
+        block = np.asarray(X[start : start + RIDGE_BLOCK_ROWS], dtype=np.float32)
+        scores = block @ coef + probe["intercept"][alpha_index]
+        predictions[start : start + len(block)] = probe["classes"][scores.argmax(axis=1)]
+    return predictions
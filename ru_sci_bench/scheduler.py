@@ -0,0 +1,109 @@
+from collections.abc import Callable, Mapping
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Iterator, Optional
+
+import numpy as np
+from threadpoolctl import threadpool_limits
+
+from ru_sci_bench.embeddings import (
+    GATHER_BLOCK_ROWS,
+    EmbeddingMatrix,
+    _get_n_workers,
+    create_shared_file,
+)
+
+_worker_embeddings: Optional[EmbeddingMatrix] = None
+
+
+def get_n_task_workers(n_workers: int, n_tasks: int) -> int:
+    """Number of worker processes for `n_tasks` tasks (-1 means all cores)."""
+    return max(1, min(_get_n_workers(n_workers), n_tasks))
+
+
+def _copy_to_shared_file(
+    embeddings: Mapping, paper_ids: np.array
+) -> tuple[IO[bytes], tuple[int, int], np.dtype]:
+    """Copy embeddings of the required papers to a new shared file (see `create_shared_file`)
+    block by block, so that a dictionary is unified into the shared matrix directly."""
+    if isinstance(embeddings, EmbeddingMatrix):
+        dim, dtype = embeddings.dim, embeddings.dtype
+    else:
+        first = np.asarray(embeddings[paper_ids[0]]) if len(paper_ids) else np.empty(0)
+        dim, dtype = len(first), first.dtype
+    shape = (len(paper_ids), dim)
+    f = create_shared_file(max(1, shape[0] * shape[1]) * dtype.itemsize)
+    try:
+        vectors = np.memmap(f.name, dtype=dtype, mode="r+", shape=shape)
+        for start in range(0, len(paper_ids), GATHER_BLOCK_ROWS):
+            block_ids = paper_ids[start : start + GATHER_BLOCK_ROWS]
+            if isinstance(embeddings, EmbeddingMatrix):
+                vectors[start : start + len(block_ids)] = embeddings.take(block_ids)
+            else:
+                for i, id_ in enumerate(block_ids.tolist(), start):
+                    vectors[i] = embeddings[id_]
+        vectors.flush()
+        del vectors
+    except BaseException:
+        f.close()
+        raise
+    return f, shape, dtype
+
+
+def _init_task_worker(
+    path: str, shape: tuple[int, int], dtype: np.dtype, paper_ids: np.array
+) -> None:
+    global _worker_embeddings
+    # tasks run side by side, so each one is limited to a single BLAS/OpenMP thread
+    threadpool_limits(limits=1)
+    vectors = np.memmap(path, dtype=dtype, mode="r", shape=shape)
+    _worker_embeddings = EmbeddingMatrix(paper_ids, vectors)
+
+
+def _run_worker_task(run_task: Callable, task: str, kwargs: dict) -> dict:
+    return run_task(task, _worker_embeddings, **kwargs)
+
+
+def run_tasks_in_workers(
+    run_task: Callable[..., dict],
+    tasks: list[str],
+    embeddings: Mapping,
+    paper_ids: np.array,
+    n_workers: int,
+    **kwargs,
+) -> Iterator[tuple[str, dict]]:
+    """Run independent tasks concurrently in worker processes.
+
+    Embeddings of the required papers are copied once to a shared file that every worker
+    maps, so the embeddings matrix is never pickled. The file is placed in /dev/shm if it
+    fits there (see `create_shared_file`), and `embeddings` is not referenced after the copy,
+    so the caller can free it.
+    Each task is computed exactly as in a sequential run, and results are yielded in
+    the order of `tasks`.
+
+    Arguments:
+        run_task -- module-level function called as `run_task(task, embeddings, **kwargs)`
+        tasks -- names of the tasks to run
+        embeddings -- EmbeddingMatrix or dictionary paper id -> vector with all required papers
+        paper_ids -- sorted unique ids of the papers used by the tasks
+        n_workers -- number of worker processes (-1 means all cores)
+        kwargs -- other arguments of `run_task`
+
+    Returns:
+        results -- iterator over (task, result of `run_task`) pairs
+    """
+    paper_ids = np.asarray(paper_ids, dtype=np.int64)
+    shared_file, shape, dtype = _copy_to_shared_file(embeddings, paper_ids)
+    del embeddings
+    with shared_file:
+        pool = ProcessPoolExecutor(
+            get_n_task_workers(n_workers, len(tasks)),
+            initializer=_init_task_worker,
+            initargs=(shared_file.name, shape, dtype, paper_ids),
+        )
+        try:
+            futures = [pool.submit(_run_worker_task, run_task, task, kwargs) for task in tasks]
+            for task, future in zip(tasks, futures):
+                yield task, future.result()
+        finally:
+            # the pending tasks are dropped if one of them fails
+            pool.shutdown(cancel_futures=True)
@@ -0,0 +1,479 @@
+from collections.abc import Callable, Iterator, Mapping
+from typing import Optional, Union
+
+import numpy as np
+from sklearn.cluster import KMeans
+
+from ru_sci_bench.embeddings import GATHER_BLOCK_ROWS, gather_embeddings
+from ru_sci_bench.utils import get_compute_dtype
+
+SEARCH_MEMORY_BUDGET = 1 << 28  # bytes of similarities computed at once
+SEARCH_BACKENDS = ["exact", "ivf", "float16"]
+CSLS_K = 10
+IVF_N_PROBE = 16
+IVF_TRAIN_SAMPLES_PER_LIST = 64
+
+
+def get_search_dtype(*embeddings: np.array) -> np.dtype:
+    """Dtype to compare embeddings in: float32 unless some of them are float64."""
+    return np.result_type(*[get_compute_dtype(x.dtype) for x in embeddings])
+
+
+def normalize_embeddings(embeddings: np.array, dtype: Optional[np.dtype] = None) -> np.array:
+    """L2-normalized copy of the embeddings, computed block by block. Zero vectors stay zero.
+
+    Arguments:
+        embeddings -- 2-D array of embeddings
+        dtype -- dtype of the result, the compute dtype of the embeddings by default
+
+    Returns:
+        normalized -- C-contiguous array with unit rows
+    """
+    dtype = get_search_dtype(embeddings) if dtype is None else np.dtype(dtype)
+    normalized = np.empty(embeddings.shape, dtype=dtype)
+    for start in range(0, len(embeddings), GATHER_BLOCK_ROWS):
+        block = np.asarray(embeddings[start : start + GATHER_BLOCK_ROWS], dtype=dtype)
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        np.divide(block, norms, out=normalized[start : start + len(block)])
+    return normalized
+
+
+def get_block_rows(n_columns: int, dtype: np.dtype, memory_budget: int) -> int:
+    """Number of query rows whose similarities to `n_columns` vectors fit in `memory_budget`."""
+    return max(1, memory_budget // max(1, n_columns * np.dtype(dtype).itemsize))
+
+
+def iter_similarity_blocks(
+    queries: np.array, corpus: np.array, memory_budget: int = SEARCH_MEMORY_BUDGET
+) -> Iterator[tuple[int, np.array]]:
+    """Compute the similarity matrix `queries @ corpus.T` block of query rows by block.
+
+    Arguments:
+        queries -- normalized query embeddings
+        corpus -- normalized embeddings to search in, of the same dtype
+        memory_budget -- maximum size of a block of similarities in bytes
+
+    Returns:
+        blocks -- iterator over (index of the first query row, block of similarities) pairs
+    """
+    block_rows = get_block_rows(len(corpus), corpus.dtype, memory_budget)
+    for start in range(0, len(queries), block_rows):
+        yield start, queries[start : start + block_rows] @ corpus.T
+
+
+def get_top_k(similarities: np.array, k: int) -> np.array:
+    """Column indices of the `k` largest values of each row, in decreasing order of value
+    (the lower index first among equal values)."""
+    if k == 1:
+        return similarities.argmax(axis=1)[:, None]
+    top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    top.sort(axis=1)
+    order = np.argsort(-np.take_along_axis(similarities, top, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+
+def cosine_top_k(
+    queries: np.array,
+    corpus: np.array,
+    k: int = 1,
+    memory_budget: int = SEARCH_MEMORY_BUDGET,
+) -> tuple[np.array, np.array]:
+    """Exact cosine nearest neighbors. The embeddings are normalized once, and blocks of
+    queries are compared with the whole corpus by one matrix product each.
+
+    Arguments:
+        queries -- query embeddings
+        corpus -- embeddings to search in
+        k -- number of nearest neighbors
+        memory_budget -- maximum size of a block of similarities in bytes
+
+    Returns:
+        indices -- (n_queries, k) array of corpus indices, most similar first
+        similarities -- (n_queries, k) array of their cosine similarities
+    """
+    dtype = get_search_dtype(queries, corpus)
+    queries = normalize_embeddings(queries, dtype)
+    corpus = normalize_embeddings(corpus, dtype)
+    k = min(k, len(corpus))
+    indices = np.empty((len(queries), k), dtype=np.int64)
+    similarities = np.empty((len(queries), k), dtype=dtype)
+    for start, block in iter_similarity_blocks(queries, corpus, memory_budget):
+        top = get_top_k(block, k)
+        indices[start : start + len(block)] = top
+        similarities[start : start + len(block)] = np.take_along_axis(block, top, axis=1)
+    return indices, similarities
+
+
+def merge_top_k(
+    indices: np.array,
+    similarities: np.array,
+    rows: Union[slice, np.array],
+    block: np.array,
+    block_ids: np.array,
+) -> None:
+    """Update the running top-k of the given query rows in place with a block of similarities.
+
+    Arguments:
+        indices, similarities -- (n_queries, k) running top-k corpus indices and similarities
+        rows -- query rows of the block
+        block -- similarities of the rows to a part of the corpus
+        block_ids -- corpus indices of the block columns
+    """
+    candidates = np.concatenate([similarities[rows], block], axis=1)
+    candidate_ids = np.concatenate([indices[rows], np.broadcast_to(block_ids, block.shape)], axis=1)
+    top = get_top_k(candidates, indices.shape[1])
+    indices[rows] = np.take_along_axis(candidate_ids, top, axis=1)
+    similarities[rows] = np.take_along_axis(candidates, top, axis=1)
+
+
+def iter_similarity_tiles(
+    queries: np.array, corpus: np.array, memory_budget: int = SEARCH_MEMORY_BUDGET
+) -> Iterator[tuple[int, int, np.array]]:
+    """Compute the similarity matrix `queries @ corpus.T` tile by tile, reading the rows of
+    both sides from (possibly memory-mapped) arrays only for the current tile. Half precision
+    rows are upcast to float32 tile by tile.
+
+    Arguments:
+        queries -- normalized query embeddings
+        corpus -- normalized embeddings to search in, of the same dtype
+        memory_budget -- maximum size in bytes of a tile of similarities with a boolean
+            mask of it and of the query and corpus rows it is computed from
+
+    Returns:
+        tiles -- iterator over (first query row, first corpus row, tile of similarities)
+    """
+    dtype = get_search_dtype(queries, corpus)
+    dim, itemsize = corpus.shape[1], dtype.itemsize
+    tile_cols = max(
+        1,
+        min(
+            len(corpus),
+            int(np.sqrt(memory_budget // (itemsize + 1))),
+            memory_budget // (2 * dim * itemsize),
+        ),
+    )
+    # a query row takes its similarities, one byte per similarity for the comparison mask
+    # and the row itself
+    tile_rows = max(
+        1,
+        (memory_budget - tile_cols * dim * itemsize)
+        // (tile_cols * (itemsize + 1) + dim * itemsize),
+    )
+    for col_start in range(0, len(corpus), tile_cols):
+        corpus_tile = np.asarray(corpus[col_start : col_start + tile_cols], dtype=dtype)
+        for row_start in range(0, len(queries), tile_rows):
+            yield row_start, col_start, np.asarray(
+                queries[row_start : row_start + tile_rows], dtype=dtype
+            ) @ corpus_tile.T
+
+
+def normalize_embeddings_to_file(
+    embeddings: Mapping,
+    ids: np.array,
+    path: str,
+    memory_budget: int = SEARCH_MEMORY_BUDGET,
+    dtype: Optional[np.dtype] = None,
+) -> np.array:
+    """Gather and L2-normalize embeddings of the given papers into a `.npy` file block by block.
+
+    Arguments:
+        embeddings -- EmbeddingMatrix or embeddings dict
+        ids -- paper ids
+        path -- `.npy` file to write
+        memory_budget -- maximum size of a block of embeddings in bytes
+        dtype -- dtype of the file, the compute dtype of the embeddings by default
+
+    Returns:
+        normalized -- read-only memory-mapped array with one unit row per id
+    """
+    dim = len(embeddings[int(ids[0])]) if len(ids) else 0
+    block_rows = max(1, min(GATHER_BLOCK_ROWS, memory_budget // max(1, 16 * dim)))
+    normalized = None
+    for start in range(0, len(ids), block_rows):
+        block = normalize_embeddings(gather_embeddings(embeddings, ids[start : start + block_rows]))
+        if normalized is None:
+            normalized = np.lib.format.open_memmap(
+                path, mode="w+", dtype=dtype or block.dtype, shape=(len(ids), dim)
+            )
+        normalized[start : start + len(block)] = block
+    if normalized is None:
+        np.save(path, np.empty((0, dim), dtype=dtype or np.float32))
+    else:
+        normalized.flush()
+        del normalized
+    return np.load(path, mmap_mode="r")
+
+
+def _get_pair_tiles(
+    x: np.array, y: np.array, memory_budget: int, out_of_core: bool
+) -> tuple[np.array, np.array, Callable[[], Iterator[tuple[int, int, np.array]]]]:
+    """Normalized pairs and a function iterating over the tiles of their similarity matrix
+    (full rows unless out of core, see `gold_pair_ranks`)."""
+    if len(x) != len(y):
+        raise ValueError(f"x and y must be pairs, got {len(x)} and {len(y)} vectors")
+    if not out_of_core:
+        dtype = get_search_dtype(x, y)
+        x = normalize_embeddings(x, dtype)
+        y = normalize_embeddings(y, dtype)
+
+    def iter_tiles() -> Iterator[tuple[int, int, np.array]]:
+        if out_of_core:
+            return iter_similarity_tiles(x, y, memory_budget)
+        return ((start, 0, block) for start, block in iter_similarity_blocks(x, y, memory_budget))
+
+    return x, y, iter_tiles
+
+
+def _get_gold_similarities(x: np.array, y: np.array, memory_budget: int) -> np.array:
+    """Similarities of the pairs `x[i]`, `y[i]`, reading blocks of both sides that fit in
+    `memory_budget` bytes together."""
+    dtype = get_search_dtype(x, y)
+    block_rows = max(
+        1, min(GATHER_BLOCK_ROWS, memory_budget // max(1, 2 * x.shape[1] * dtype.itemsize))
+    )
+    return np.concatenate(
+        [np.empty(0, dtype=dtype)]
+        + [
+            np.einsum(
+                "ij,ij->i",
+                np.asarray(x[start : start + block_rows], dtype=dtype),
+                np.asarray(y[start : start + block_rows], dtype=dtype),
+            )
+            for start in range(0, len(x), block_rows)
+        ]
+    )
+
+
+def _get_tie_tolerance(x: np.array) -> float:
+    """Largest difference between a similarity of the tiles and a gold similarity that counts
+    as a tie: they are computed by different routines, whose rounding errors grow with
+    the dimension of the embeddings."""
+    return 4 * np.sqrt(x.shape[1]) * np.finfo(get_search_dtype(x)).eps
+
+
+def _count_ranked_above(
+    similarities: np.array, gold: np.array, row_start: int, col_start: int, tolerance: float
+) -> np.array:
+    """Number of candidates ranked above the gold pair in every row of `similarities`: the more
+    similar ones and, as argmax breaks ties, the equally similar ones with a lower index.
+    The gold pair of row `i` is the candidate `row_start + i`, candidate `j` has index
+    `col_start + j`."""
+    counts = np.count_nonzero(similarities > gold[:, None] + tolerance, axis=1)
+    tied_rows = np.flatnonzero(
+        np.count_nonzero(similarities >= gold[:, None] - tolerance, axis=1) > counts
+    )
+    # ties are rare unless the embeddings are degenerate (e.g. constant or zero vectors)
+    for row in tied_rows:
+        n_lower = min(max(row_start + row - col_start, 0), similarities.shape[1])
+        counts[row] += np.count_nonzero(
+            np.abs(similarities[row, :n_lower] - gold[row]) <= tolerance
+        )
+    return counts
+
+
+def _count_better_candidates(
+    tile: np.array,
+    row_start: int,
+    col_start: int,
+    gold: np.array,
+    x_ranks: np.array,
+    y_ranks: np.array,
+    tolerance: float,
+) -> None:
+    """Add the number of candidates ranked above the gold pairs in a tile to the ranks
+    (see `_count_ranked_above`)."""
+    row_end, col_end = row_start + tile.shape[0], col_start + tile.shape[1]
+    # the gold pairs themselves are not counted
+    pairs = np.arange(max(row_start, col_start), min(row_end, col_end))
+    tile[pairs - row_start, pairs - col_start] = -np.inf
+    x_ranks[row_start:row_end] += _count_ranked_above(
+        tile, gold[row_start:row_end], row_start, col_start, tolerance
+    )
+    y_ranks[col_start:col_end] += _count_ranked_above(
+        tile.T, gold[col_start:col_end], col_start, row_start, tolerance
+    )
+
+
+def _update_top_k_values(top: np.array, candidates: np.array) -> None:
+    """Update the `top.shape[1]` largest values of every row of `top` in place with the values
+    of `candidates`. Only the rows with a candidate above their current k-th value are merged."""
+    updated = np.flatnonzero((candidates > top.min(axis=1)[:, None]).any(axis=1))
+    if not len(updated):
+        return
+    merged = np.concatenate([top[updated], candidates[updated]], axis=1)
+    top[updated] = -np.partition(-merged, top.shape[1] - 1, axis=1)[:, : top.shape[1]]
+
+
+def gold_pair_ranks(
+    x: np.array,
+    y: np.array,
+    memory_budget: int = SEARCH_MEMORY_BUDGET,
+    out_of_core: bool = False,
+) -> tuple[np.array, np.array]:
+    """Rank of the gold pair of every vector in both search directions, where `x[i]` and `y[i]`
+    are a pair, from a single pass over the similarity matrix. The rank is one plus the number
+    of other candidates that are more similar than the gold pair, or as similar (up to rounding
+    errors) with a lower index, so that rank 1 is the argmax. Collapsed embeddings, e.g. all
+    zero, get recall@1 of 1 / len(x) as with argmax.
+
+    Arguments:
+        x, y -- embeddings of the two sides, of the same length
+        memory_budget -- maximum size of a block of similarities in bytes
+        out_of_core -- if True, `x` and `y` must be normalized embeddings of the same dtype,
+            e.g. memory-mapped files written by `normalize_embeddings_to_file`. They are not
+            copied but read tile by tile (see `iter_similarity_tiles`), and the counts are
+            accumulated over the tiles
+
+    Returns:
+        x_ranks -- rank of `y[i]` among the nearest `y` of `x[i]`
+        y_ranks -- rank of `x[i]` among the nearest `x` of `y[i]`
+    """
+    x, y, iter_tiles = _get_pair_tiles(x, y, memory_budget, out_of_core)
+    gold = _get_gold_similarities(x, y, memory_budget)
+    tolerance = _get_tie_tolerance(x)
+    x_ranks = np.ones(len(x), dtype=np.int64)
+    y_ranks = np.ones(len(y), dtype=np.int64)
+    for row_start, col_start, tile in iter_tiles():
+        _count_better_candidates(tile, row_start, col_start, gold, x_ranks, y_ranks, tolerance)
+    return x_ranks, y_ranks
+
+
+def csls_gold_pair_ranks(
+    x: np.array,
+    y: np.array,
+    k: int = CSLS_K,
+    memory_budget: int = SEARCH_MEMORY_BUDGET,
+    out_of_core: bool = False,
+) -> tuple[np.array, np.array, np.array, np.array]:
+    """Ranks of the gold pairs by cosine similarity (see `gold_pair_ranks`) and by CSLS
+    (cross-domain similarity local scaling) `2 * cos(x, y) - r_y(x) - r_x(y)`, where `r_y(x)`
+    is the mean similarity of `x` to its `k` nearest `y`, which penalizes hubs. The first pass
+    over the similarity matrix counts the cosine ranks and collects the top-k similarities of
+    its rows and columns, the second one counts the CSLS ranks.
+
+    Arguments:
+        x, y -- embeddings of the two sides, of the same length
+        k -- size of the neighbourhoods
+        memory_budget, out_of_core -- see `gold_pair_ranks`
+
+    Returns:
+        x_ranks, y_ranks -- cosine ranks of the gold pairs in both directions
+        x_csls_ranks, y_csls_ranks -- CSLS ranks of the gold pairs in both directions
+    """
+    x, y, iter_tiles = _get_pair_tiles(x, y, memory_budget, out_of_core)
+    k = max(1, min(k, len(x)))
+    gold = _get_gold_similarities(x, y, memory_budget)
+    tolerance = _get_tie_tolerance(x)
+    x_ranks = np.ones(len(x), dtype=np.int64)
+    y_ranks = np.ones(len(y), dtype=np.int64)
+    x_top = np.full((len(x), k), -np.inf, dtype=get_search_dtype(x))
+    y_top = np.full((len(y), k), -np.inf, dtype=get_search_dtype(y))
+    for row_start, col_start, tile in iter_tiles():
+        rows = slice(row_start, row_start + tile.shape[0])
+        cols = slice(col_start, col_start + tile.shape[1])
+        _update_top_k_values(x_top[rows], tile)
+        _update_top_k_values(y_top[cols], tile.T)
+        _count_better_candidates(tile, row_start, col_start, gold, x_ranks, y_ranks, tolerance)
+
+    x_mean, y_mean = x_top.mean(axis=1), y_top.mean(axis=1)
+    del x_top, y_top
+    csls_gold = 2 * gold - x_mean - y_mean
+    # the rounding errors of the similarities are doubled, and those of the sums added
+    csls_tolerance = 3 * tolerance
+    x_csls_ranks = np.ones(len(x), dtype=np.int64)
+    y_csls_ranks = np.ones(len(y), dtype=np.int64)
+    for row_start, col_start, tile in iter_tiles():
+        tile *= 2
+        tile -= x_mean[row_start : row_start + tile.shape[0], None]
+        tile -= y_mean[col_start : col_start + tile.shape[1]]
+        _count_better_candidates(
+            tile, row_start, col_start, csls_gold, x_csls_ranks, y_csls_ranks, csls_tolerance
+        )
+    return x_ranks, y_ranks, x_csls_ranks, y_csls_ranks
+
+
+class IVFIndex:
+    """Inverted file index for approximate cosine search. The corpus is split into lists by
+    the nearest centroid of k-means, and a query is compared only with the vectors of
+    the lists of its `n_probe` nearest centroids.
+
+    Arguments:
+        corpus -- embeddings to search in
+        n_lists -- number of k-means clusters, the square root of the corpus size by default
+        n_probe -- number of lists searched for every query
+        memory_budget -- maximum size of a block of similarities in bytes
+        random_state -- seed of the k-means training sample and initialization
+    """
+
+    def __init__(
+        self,
+        corpus: np.array,
+        n_lists: Optional[int] = None,
+        n_probe: int = IVF_N_PROBE,
+        memory_budget: int = SEARCH_MEMORY_BUDGET,
+        random_state: int = 0,
+    ) -> None:
+        self.dtype = get_search_dtype(corpus)
+        corpus = normalize_embeddings(corpus, self.dtype)
+        self.n_lists = min(n_lists or max(1, int(np.sqrt(len(corpus)))), len(corpus))
+        self.n_probe = min(n_probe, self.n_lists)
+        self.memory_budget = memory_budget
+
+        rng = np.random.default_rng(random_state)
+        n_train = min(len(corpus), self.n_lists * IVF_TRAIN_SAMPLES_PER_LIST)
+        train = corpus[np.sort(rng.choice(len(corpus), n_train, replace=False))]
+        kmeans = KMeans(self.n_lists, n_init=1, max_iter=20, random_state=random_state)
+        self.centroids = normalize_embeddings(kmeans.fit(train).cluster_centers_, self.dtype)
+
+        lists = np.concatenate([block.argmax(axis=1) for _, block in self._centroid_blocks(corpus)])
+        # vectors of a list are stored together, `ids` maps them back to the corpus indices
+        self.ids = np.argsort(lists, kind="stable")
+        self.vectors = corpus[self.ids]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=self.n_lists))])
+
+    def _centroid_blocks(self, queries: np.array) -> Iterator[tuple[int, np.array]]:
+        return iter_similarity_blocks(queries, self.centroids, self.memory_budget)
+
+    def search(self, queries: np.array, k: int = 1) -> tuple[np.array, np.array]:
+        """Approximate cosine nearest neighbors of the queries.
+
+        Arguments:
+            queries -- query embeddings
+            k -- number of nearest neighbors
+
+        Returns:
+            indices -- (n_queries, k) array of corpus indices, most similar first, -1 where
+                the probed lists have less than `k` vectors
+            similarities -- (n_queries, k) array of their cosine similarities
+        """
+        queries = normalize_embeddings(queries, self.dtype)
+        probes = np.concatenate(
+            [get_top_k(block, self.n_probe) for _, block in self._centroid_blocks(queries)]
+        )
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        similarities = np.full((len(queries), k), -np.inf, dtype=self.dtype)
+
+        # queries are grouped by the probed list, every list is compared with its queries at once
+        probe_queries = np.repeat(np.arange(len(queries)), self.n_probe)
+        order = np.argsort(probes.ravel(), kind="stable")
+        query_offsets = np.searchsorted(probes.ravel()[order], np.arange(self.n_lists + 1))
+        for list_ in range(self.n_lists):
+            list_vectors = self.vectors[self.offsets[list_] : self.offsets[list_ + 1]]
+            list_ids = self.ids[self.offsets[list_] : self.offsets[list_ + 1]]
+            list_queries = probe_queries[order[query_offsets[list_] : query_offsets[list_ + 1]]]
+            for start, block in iter_similarity_blocks(
+                queries[list_queries], list_vectors, self.memory_budget
+            ):
+                rows = list_queries[start : start + len(block)]
+                merge_top_k(indices, similarities, rows, block, list_ids)
+        return indices, similarities
+
+
+def build_search_index(
+    corpus: np.array, search_backend: str, memory_budget: int = SEARCH_MEMORY_BUDGET
+) -> IVFIndex:
+    """Approximate search index of a corpus for the 'ivf' backend of SEARCH_BACKENDS."""
+    if search_backend == "ivf":
+        return IVFIndex(corpus, memory_budget=memory_budget)
+    raise ValueError(f"Unknown approximate search_backend: {search_backend}")
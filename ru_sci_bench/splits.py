@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+SPLITS_CACHE_PATH = os.environ.get(
+    "RU_SCI_BENCH_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "ru_sci_bench")
+)
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def _get_int_dtype(values: np.array) -> np.dtype:
+    """Smallest of int16, int32 and int64 that holds all values."""
+    for dtype in [np.int16, np.int32]:
+        info = np.iinfo(dtype)
+        if not len(values) or (values.min() >= info.min and values.max() <= info.max):
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def _compact_array(values: np.array) -> np.array:
+    """Integer arrays in the smallest dtype (see `_get_int_dtype`) and Python objects, e.g.
+    string labels, as fixed-width strings, which can be memory-mapped unlike objects."""
+    if values.dtype.kind == "i":
+        return values.astype(_get_int_dtype(values))
+    if values.dtype.kind == "O":
+        return values.astype(str)
+    return values
+
+
+def _parse_split(path: str) -> dict[str, np.array]:
+    """Read a split file: ids and labels of a classification csv or the russian and
+    english paper ids of the translations json."""
+    if path.endswith(".json"):
+        with open(path) as f:
+            translation_test = json.load(f)
+        return {
+            "ru_ids": np.array([int(id_) for id_ in translation_test.keys()], dtype=np.int64),
+            "en_ids": np.array([int(id_) for id_ in translation_test.values()], dtype=np.int64),
+        }
+    split = pd.read_csv(path)
+    return {"ids": split.id.to_numpy(), "labels": split.label.to_numpy()}
+
+
+def _read_manifest(cache_path: str) -> dict:
+    try:
+        with open(os.path.join(cache_path, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if manifest.get("version") == MANIFEST_VERSION else {}
+
+
+def _save_array(path: str, values: np.array) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, values)
+    os.replace(tmp_path, path)
+
+
+def _save_manifest(cache_path: str, manifest: dict) -> None:
+    path = os.path.join(cache_path, MANIFEST_FILE)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def compile_split(path: str, cache_path: str = SPLITS_CACHE_PATH) -> dict[str, np.array]:
+    """Parse a split file and save its arrays as `.npy` files, integers in the smallest dtype
+    (see `_compact_array`), registering them in the manifest of the cache directory.
+
+    Arguments:
+        path -- path to a classification csv or to the translations json
+        cache_path -- directory with the compiled splits
+
+    Returns:
+        arrays -- parsed arrays by name
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    arrays = _parse_split(path)
+    os.makedirs(cache_path, exist_ok=True)
+    prefix = hashlib.blake2b(path.encode(), digest_size=8).hexdigest()
+    entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "arrays": {}}
+    for name, values in arrays.items():
+        values = arrays[name] = _compact_array(values)
+        file_name = f"{prefix}.{name}.npy"
+        _save_array(os.path.join(cache_path, file_name), values)
+        entry["arrays"][name] = {
+            "file": file_name,
+            "dtype": values.dtype.name,
+            "shape": list(values.shape),
+        }
+
+    manifest = _read_manifest(cache_path) or {"version": MANIFEST_VERSION, "splits": {}}
+    manifest["splits"][path] = entry
+    _save_manifest(cache_path, manifest)
+    return arrays
+
+
+def load_split(path: str, cache_path: str = SPLITS_CACHE_PATH) -> dict[str, np.array]:
+    """Load the arrays of a split file from the compiled cache, memory-mapped. The split is
+    compiled on the first use and recompiled when the file changes.
+
+    Arguments:
+        path -- path to a classification csv or to the translations json
+        cache_path -- directory with the compiled splits
+
+    Returns:
+        arrays -- `ids` and `labels` for a classification csv, `ru_ids` and `en_ids`
+            for the translations json
+    """
+    path = os.path.abspath(path)
+    entry = _read_manifest(cache_path).get("splits", {}).get(path)
+    stat = os.stat(path)
+    if entry is not None and (entry["size"], entry["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+        try:
+            return {
+                name: np.load(os.path.join(cache_path, array["file"]), mmap_mode="r")
+                for name, array in entry["arrays"].items()
+            }
+        except OSError:
+            pass
+    try:
+        return compile_split(path, cache_path)
+    except OSError as e:
+        warnings.warn(f"Could not write compiled splits: {e}")
+        return _parse_split(path)
+
+
+def load_classification_split(path: str) -> tuple[np.array, np.array]:
+    """Paper ids and labels of a classification csv (see `load_split`)."""
+    split = load_split(path)
+    return split["ids"], split["labels"]
+
+
+def load_translation_pairs(path: str) -> tuple[np.array, np.array]:
+    """Ids of the russian papers and of their english translations (see `load_split`)."""
+    split = load_split(path)
+    return split["ru_ids"], split["en_ids"]
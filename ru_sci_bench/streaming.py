@@ -0,0 +1,111 @@
+from collections.abc import Mapping
+
+import numpy as np
+from sklearn.linear_model import SGDClassifier
+from sklearn.metrics import classification_report, f1_score
+
+from ru_sci_bench.embeddings import EmbeddingMatrix, gather_embeddings
+
+SGD_BATCH_SIZE = 4096
+SGD_MAX_EPOCHS = 20
+SGD_VALIDATION_FRACTION = 0.1
+SGD_N_ITER_NO_CHANGE = 3
+SGD_TOL = 1e-4
+
+
+def predict_in_batches(
+    model: SGDClassifier, embeddings: Mapping, ids: np.array, batch_size: int = SGD_BATCH_SIZE
+) -> np.array:
+    """Labels predicted for the given papers, gathering their embeddings batch by batch."""
+    predictions = np.empty(len(ids), dtype=model.classes_.dtype)
+    for start in range(0, len(ids), batch_size):
+        batch_ids = ids[start : start + batch_size]
+        predictions[start : start + len(batch_ids)] = model.predict(
+            gather_embeddings(embeddings, batch_ids)
+        )
+    return predictions
+
+
+def stream_classify(
+    embeddings: Mapping,
+    train_ids: np.array,
+    y_train: np.array,
+    test_ids: np.array,
+    y_test: np.array,
+    loss: str = "hinge",
+    batch_size: int = SGD_BATCH_SIZE,
+    max_epochs: int = SGD_MAX_EPOCHS,
+    get_cls_report: bool = False,
+    silent: bool = False,
+) -> dict:
+    """
+    Classification with a linear model trained by SGD on shuffled mini-batches that are
+        gathered from the embeddings one at a time, so that the training matrix is never held
+        in memory (e.g. with a memory-mapped embeddings store). A random slice of the training
+        papers is held out, and training stops when its accuracy has not improved for
+        SGD_N_ITER_NO_CHANGE epochs; the model of the best epoch is evaluated.
+
+    Arguments:
+        embeddings -- EmbeddingMatrix or embeddings dict
+        train_ids, y_train -- training paper ids and labels
+        test_ids, y_test -- test paper ids and labels to evaluate on
+        loss -- loss of SGDClassifier: 'hinge' for a linear SVM or 'log_loss' for
+            logistic regression
+        batch_size -- number of papers in a mini-batch
+        max_epochs -- maximum number of passes over the training papers
+        get_cls_report -- return classification_report
+        silent -- silent all outputs
+
+    Returns:
+        metrics -- dict with macro average F1, weighted average F1 and optionally classification_report
+            on the test papers
+    """
+    train_ids, y_train = np.asarray(train_ids), np.asarray(y_train)
+    classes = np.unique(y_train)
+    rng = np.random.default_rng(42)
+    order = rng.permutation(len(train_ids))
+    n_validation = int(len(train_ids) * SGD_VALIDATION_FRACTION)
+    validation, fit = np.sort(order[:n_validation]), order[n_validation:]
+    if isinstance(embeddings, EmbeddingMatrix):
+        storage_rows = embeddings.rows(train_ids)
+    else:
+        storage_rows = np.arange(len(train_ids))
+
+    model = SGDClassifier(loss=loss, random_state=42)
+    best_score, best_state, n_no_change = -np.inf, None, 0
+    for epoch in range(max_epochs):
+        fit = rng.permutation(fit)
+        for start in range(0, len(fit), batch_size):
+            # rows of a batch are read in storage order
+            batch = fit[start : start + batch_size]
+            batch = batch[np.argsort(storage_rows[batch], kind="stable")]
+            X_batch = gather_embeddings(embeddings, train_ids[batch])
+            model.partial_fit(X_batch, y_train[batch], classes=classes)
+
+        if not n_validation:
+            continue
+        score = np.mean(
+            predict_in_batches(model, embeddings, train_ids[validation], batch_size)
+            == y_train[validation]
+        )
+        if not silent:
+            print(f"Epoch {epoch + 1}: held-out accuracy {score:.4f}")
+        if score > best_score + SGD_TOL:
+            best_score, n_no_change = score, 0
+            best_state = (model.coef_.copy(), model.intercept_.copy())
+        else:
+            n_no_change += 1
+            if n_no_change >= SGD_N_ITER_NO_CHANGE:
+                break
+    if best_state is not None:
+        model.coef_, model.intercept_ = best_state
+
+    y_test = np.asarray(y_test)
+    y_pred = predict_in_batches(model, embeddings, np.asarray(test_ids), batch_size)
+    result = {
+        "macro_f1": f1_score(y_test, y_pred, average="macro"),
+        "weighted_f1": f1_score(y_test, y_pred, average="weighted"),
+    }
+    if get_cls_report:
+        result["cls_report"] = classification_report(y_test, y_pred)
+    return result
@@ -1,15 +1,41 @@
+import glob
+import gzip
+import io
 import json
 import os
-from typing import Optional
+import re
+from collections.abc import Collection
+from typing import IO, Optional, Union
 
 import numpy as np
 from tqdm import tqdm
 
+from ru_sci_bench.splits import load_split
+
 PROJECT_ROOT_PATH = os.path.abspath(os.path.dirname(__file__))
 
+METRICS = ["translation_search", "full_classification", "ru_classification", "en_classification"]
+
+PAPER_ID_PATTERN = re.compile(r'"paper_id"\s*:\s*(-?\d+)')
+PAPER_ID_BYTES_PATTERN = re.compile(PAPER_ID_PATTERN.pattern.encode())
+
+COMPRESSED_SUFFIXES = (".gz", ".zst")
+EMBEDDINGS_FILE_PATTERNS = ["*.jsonl", "*.jsonl.gz", "*.jsonl.zst"]
+
 
 class DataPaths:
-    def __init__(self, base_path: Optional[str] = None) -> None:
+    """Paths to the benchmark data.
+
+    Arguments:
+        base_path -- directory with the task files, the data shipped with the package by default
+        ru_en_translation_test -- path to another russian-english translations file (e.g.
+            a larger pool for translation_search), `base_path/ru_en_translation_test.json`
+            by default
+    """
+
+    def __init__(
+        self, base_path: Optional[str] = None, ru_en_translation_test: Optional[str] = None
+    ) -> None:
         if base_path is None:
             base_path = os.path.join(PROJECT_ROOT_PATH, "data")
         self.base_path = base_path
@@ -32,35 +58,162 @@ class DataPaths:
         self.elibrary_grnti_en_train = os.path.join(base_path, "elibrary_grnti_en", "train.csv")
         self.elibrary_grnti_en_test = os.path.join(base_path, "elibrary_grnti_en", "test.csv")
 
-        self.ru_en_translation_test = os.path.join(base_path, "ru_en_translation_test.json")
+        self.ru_en_translation_test = ru_en_translation_test or os.path.join(
+            base_path, "ru_en_translation_test.json"
+        )
+
+    def get_metric_paths(self, metric: str) -> list[str]:
+        """Paths to the files used by a metric from METRICS."""
+        if metric == "translation_search":
+            return [self.ru_en_translation_test]
+        language = metric.split("_")[0]
+        return [
+            getattr(self, f"elibrary_{classifier}_{language}_{split}")
+            for classifier in ["oecd", "grnti"]
+            for split in ["train", "test"]
+        ]
+
+
+def parse_metrics(metrics: Union[str, list[str]]) -> list[str]:
+    """Names of the metrics from METRICS selected by the `metrics` argument of
+    `get_ru_sci_bench_metrics` ('all', one name or a list of names)."""
+    if metrics == "all":
+        return list(METRICS)
+    if isinstance(metrics, str):
+        metrics = [metrics]
+    return [metric for metric in METRICS if metric in metrics]
+
+
+def get_required_paper_ids(data_paths: DataPaths, metrics: Union[str, list[str]]) -> np.array:
+    """Sorted ids of all papers whose embeddings are used by the selected metrics."""
+    paper_ids = [np.empty(0, dtype=np.int64)]
+    for metric in parse_metrics(metrics):
+        for path in data_paths.get_metric_paths(metric):
+            split = load_split(path)
+            paper_ids.extend(split[name] for name in ["ids", "ru_ids", "en_ids"] if name in split)
+    return np.unique(np.concatenate(paper_ids).astype(np.int64))
+
+
+def get_paper_id(line: Union[str, bytes]) -> Optional[int]:
+    """Read `paper_id` from a jsonl line without decoding the whole JSON."""
+    pattern = PAPER_ID_BYTES_PATTERN if isinstance(line, bytes) else PAPER_ID_PATTERN
+    match = pattern.search(line)
+    return int(match.group(1)) if match is not None else None
+
+
+def is_compressed(path: str) -> bool:
+    return path.endswith(COMPRESSED_SUFFIXES)
+
+
+def open_embeddings_file(path: str) -> IO[bytes]:
+    """Open a jsonl file for reading in binary mode, decompressing `.gz` and `.zst` files on the fly.
+    Reading `.zst` files requires the `zstandard` package."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError("Reading .zst files requires the zstandard package") from e
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        )
+    return open(path, "rb")
+
+
+def resolve_embeddings_paths(embeddings_path: Union[str, list[str]]) -> list[str]:
+    """Expand the embeddings location into a list of jsonl files.
 
+    Arguments:
+        embeddings_path -- path to a jsonl file (optionally compressed), a glob pattern,
+            a directory with `*.jsonl`, `*.jsonl.gz` or `*.jsonl.zst` shards or a list of those
 
-def load_embeddings_from_jsonl(embeddings_path: str) -> dict[str, np.array]:
+    Returns:
+        paths -- sorted list of files
+    """
+    if not isinstance(embeddings_path, str):
+        return [path for item in embeddings_path for path in resolve_embeddings_paths(item)]
+    if os.path.isdir(embeddings_path):
+        paths = [
+            path
+            for pattern in EMBEDDINGS_FILE_PATTERNS
+            for path in glob.glob(os.path.join(embeddings_path, pattern))
+        ]
+    elif glob.escape(embeddings_path) != embeddings_path:
+        paths = glob.glob(embeddings_path)
+    else:
+        return [embeddings_path]
+    if not paths:
+        raise FileNotFoundError(f"No embeddings files found in {embeddings_path}")
+    return sorted(paths)
+
+
+def load_embeddings_from_jsonl(
+    embeddings_path: str,
+    paper_ids: Optional[Collection[int]] = None,
+    dtype: np.dtype = np.float64,
+) -> dict[str, np.array]:
     """Load embeddings from a jsonl file.
     The file must have one embedding per line in JSON format.
     It must have two keys per line: `paper_id` and `embedding`
 
     Arguments:
-        embeddings_path -- path to the embeddings file
+        embeddings_path -- path to the embeddings file, `.gz` and `.zst` files are decompressed
+        paper_ids -- if given, only embeddings of these papers are loaded, other lines
+            are skipped before being decoded
+        dtype -- dtype of the embeddings
 
     Returns:
         embeddings -- a dictionary where each key is the paper id
                                    and the value is a numpy array
     """
     embeddings = {}
-    with open(embeddings_path, "r") as f:
+    if paper_ids is not None:
+        paper_ids = set(np.asarray(paper_ids, dtype=np.int64).tolist())
+    with open_embeddings_file(embeddings_path) as f:
         for line in tqdm(f, desc="reading embeddings from file..."):
+            if paper_ids is not None and get_paper_id(line) not in paper_ids:
+                continue
             line_json = json.loads(line)
-            embeddings[line_json["paper_id"]] = np.array(line_json["embedding"])
+            embeddings[line_json["paper_id"]] = np.array(line_json["embedding"], dtype=dtype)
     return embeddings
 
 
+def get_compute_dtype(dtype: np.dtype) -> np.dtype:
+    """dtype to compute in for embeddings stored in `dtype`: half precision is upcast to float32."""
+    return np.result_type(dtype, np.float32)
+
+
+def get_metrics_drift(results: dict, reference_results: dict) -> dict:
+    """Differences between the metrics of two `get_ru_sci_bench_metrics` runs, e.g. to check
+    the drift of float32 or float16 embeddings against float64.
+
+    Arguments:
+        results -- metrics to compare
+        reference_results -- reference metrics
+
+    Returns:
+        drift -- dictionary task -> metric -> `results` value minus `reference_results` value
+    """
+    return {
+        task_name: {
+            metric_name: value - reference_results[task_name][metric_name]
+            for metric_name, value in task_results.items()
+            if metric_name != "cls_report"
+        }
+        for task_name, task_results in results.items()
+        if task_name in reference_results
+    }
+
+
 def print_metrics(task_name: str, results: dict, silent: bool = False) -> None:
     if silent:
         return
 
     print("-" * 30)
     for metric_name, value in results[task_name].items():
-        if metric_name != "cls_report":
+        if metric_name == "C":
+            print(f"{task_name} | {metric_name} | = {value:g}")
+        elif metric_name != "cls_report":
             print(f"{task_name} | {metric_name} | = {round(value, 2)}")
     print("-" * 30)
@@ -0,0 +1,171 @@
+from collections import Counter
+from collections.abc import Mapping
+from typing import Optional
+
+import numpy as np
+
+from ru_sci_bench.embeddings import GATHER_BLOCK_ROWS, EmbeddingMatrix
+from ru_sci_bench.utils import get_compute_dtype
+
+IMPUTATION_STRATEGIES = ["zero", "mean"]
+N_SAMPLE_IDS = 5
+
+
+def find_invalid_embeddings(
+    embeddings: Mapping, paper_ids: np.array, memory_budget: Optional[int] = None
+) -> dict:
+    """Check that all required papers have finite embeddings of the same dimension.
+
+    Arguments:
+        embeddings -- EmbeddingMatrix or embeddings dict
+        paper_ids -- sorted unique ids of the required papers
+        memory_budget -- if set, the embeddings are checked in blocks of at most this number
+            of bytes, otherwise in blocks of GATHER_BLOCK_ROWS rows
+
+    Returns:
+        report -- dictionary with the embeddings dimension (`dim`) and sorted arrays of ids
+            of the papers with missing embeddings (`missing`), embeddings of another dimension
+            (`wrong_dim`) and embeddings containing NaN or inf (`non_finite`)
+    """
+    paper_ids = np.asarray(paper_ids, dtype=np.int64)
+    if isinstance(embeddings, EmbeddingMatrix):
+        present = embeddings.isin(paper_ids)
+        dim, itemsize = embeddings.dim, embeddings.dtype.itemsize
+        wrong_dim = np.zeros(len(paper_ids), dtype=bool)
+    else:
+        present = np.array([id_ in embeddings for id_ in paper_ids.tolist()], dtype=bool)
+        lengths = np.array([len(embeddings[id_]) for id_ in paper_ids[present].tolist()], dtype=int)
+        dim = Counter(lengths.tolist()).most_common(1)[0][0] if len(lengths) else 0
+        wrong_dim = np.zeros(len(paper_ids), dtype=bool)
+        wrong_dim[present] = lengths != dim
+        itemsize = np.asarray(embeddings[paper_ids[present][0]]).itemsize if len(lengths) else 1
+
+    non_finite = np.zeros(len(paper_ids), dtype=bool)
+    checked = np.flatnonzero(present & ~wrong_dim)
+    # a gathered row and its mask of finite values
+    block_rows = _get_block_rows(dim * (itemsize + 1), memory_budget)
+    for start in range(0, len(checked), block_rows):
+        block = checked[start : start + block_rows]
+        non_finite[block] = ~np.isfinite(_gather(embeddings, paper_ids[block])).all(axis=1)
+
+    return {
+        "dim": dim,
+        "missing": paper_ids[~present],
+        "wrong_dim": paper_ids[wrong_dim],
+        "non_finite": paper_ids[non_finite],
+    }
+
+
+def _get_block_rows(row_bytes: int, memory_budget: Optional[int]) -> int:
+    if memory_budget is None:
+        return GATHER_BLOCK_ROWS
+    return max(1, min(GATHER_BLOCK_ROWS, memory_budget // max(1, row_bytes)))
+
+
+def _gather(embeddings: Mapping, ids: np.array) -> np.array:
+    if isinstance(embeddings, EmbeddingMatrix):
+        return embeddings.take(ids)
+    return np.array([embeddings[id_] for id_ in ids.tolist()])
+
+
+def format_invalid_embeddings(report: dict, n_required: int) -> str:
+    """Short summary of a `find_invalid_embeddings` report with counts and sample ids."""
+
+    def sample(ids: np.array) -> str:
+        sample_ids = ", ".join(str(id_) for id_ in ids[:N_SAMPLE_IDS].tolist())
+        return f"e.g. {sample_ids}" + (", ..." if len(ids) > N_SAMPLE_IDS else "")
+
+    problems = []
+    if len(report["missing"]):
+        problems.append(
+            f"{len(report['missing'])} of {n_required} required papers have no embeddings "
+            f"({sample(report['missing'])})"
+        )
+    if len(report["wrong_dim"]):
+        problems.append(
+            f"{len(report['wrong_dim'])} embeddings have a dimension other than {report['dim']} "
+            f"({sample(report['wrong_dim'])})"
+        )
+    if len(report["non_finite"]):
+        problems.append(
+            f"{len(report['non_finite'])} embeddings contain NaN or inf "
+            f"({sample(report['non_finite'])})"
+        )
+    return "; ".join(problems)
+
+
+def impute_embeddings(
+    embeddings: Mapping,
+    paper_ids: np.array,
+    invalid_ids: np.array,
+    strategy: str,
+    memory_budget: Optional[int] = None,
+) -> EmbeddingMatrix:
+    """Build embeddings of the required papers, replacing the invalid ones.
+
+    Arguments:
+        embeddings -- EmbeddingMatrix or embeddings dict
+        paper_ids -- sorted unique ids of the required papers
+        invalid_ids -- ids of the papers whose embeddings are missing or invalid
+        strategy -- 'zero' to use zero vectors, 'mean' to use the mean of the valid embeddings
+        memory_budget -- if set, the embeddings are gathered in blocks of at most this number
+            of bytes (the imputed matrix itself is not counted)
+
+    Returns:
+        embeddings -- EmbeddingMatrix with one row per required paper
+    """
+    valid = ~np.isin(paper_ids, invalid_ids)
+    valid_ids = paper_ids[valid]
+    if isinstance(embeddings, EmbeddingMatrix):
+        dim, dtype = embeddings.dim, get_compute_dtype(embeddings.dtype)
+    else:
+        first = embeddings[valid_ids[0]] if len(valid_ids) else np.empty(0)
+        dim, dtype = len(first), get_compute_dtype(np.asarray(first).dtype)
+
+    vectors = np.zeros((len(paper_ids), dim), dtype=dtype)
+    valid_rows = np.flatnonzero(valid)
+    block_rows = _get_block_rows(dim * vectors.itemsize, memory_budget)
+    for start in range(0, len(valid_rows), block_rows):
+        block = valid_rows[start : start + block_rows]
+        vectors[block] = _gather(embeddings, paper_ids[block])
+    if strategy == "mean" and len(valid_rows):
+        vectors[~valid] = vectors[valid_rows].mean(axis=0)
+    return EmbeddingMatrix(paper_ids, vectors)
+
+
+def check_embeddings(
+    embeddings: Mapping,
+    paper_ids: np.array,
+    on_invalid: str = "raise",
+    silent: bool = False,
+    memory_budget: Optional[int] = None,
+) -> Mapping:
+    """Check embeddings of the required papers before running the tasks.
+
+    Arguments:
+        embeddings -- EmbeddingMatrix or embeddings dict
+        paper_ids -- sorted unique ids of the required papers
+        on_invalid -- what to do with missing embeddings, embeddings of another dimension or
+            with NaN/inf values: 'raise' a ValueError, or replace them with 'zero' vectors
+            or with the 'mean' of the valid embeddings of the required papers
+        silent -- silent all outputs
+        memory_budget -- if set, the embeddings are read in blocks of at most this number
+            of bytes
+
+    Returns:
+        embeddings -- `embeddings` itself if they are valid, otherwise imputed embeddings
+            of the required papers
+    """
+    if on_invalid not in ["raise"] + IMPUTATION_STRATEGIES:
+        raise ValueError(f"Unknown on_invalid value: {on_invalid}")
+    report = find_invalid_embeddings(embeddings, paper_ids, memory_budget)
+    invalid_ids = np.concatenate([report["missing"], report["wrong_dim"], report["non_finite"]])
+    if not len(invalid_ids):
+        return embeddings
+
+    message = f"Invalid embeddings: {format_invalid_embeddings(report, len(paper_ids))}"
+    if on_invalid == "raise":
+        raise ValueError(message)
+    if not silent:
+        print(f"{message}. Replacing them with {on_invalid} vectors")
+    return impute_embeddings(embeddings, paper_ids, invalid_ids, on_invalid, memory_budget)
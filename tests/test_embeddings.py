@@ -0,0 +1,77 @@
+import errno
+import json
+import os
+
+import numpy as np
+import pytest
+
+from ru_sci_bench import embeddings as embeddings_module
+from ru_sci_bench.embeddings import (
+    _count_lines,
+    _get_chunks,
+    load_embeddings_from_jsonl_parallel,
+)
+from ru_sci_bench.utils import load_embeddings_from_jsonl
+
+
+def write_jsonl(path, rows, trailing_newline=True):
+    lines = [json.dumps({"paper_id": paper_id, "embedding": vector}) for paper_id, vector in rows]
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + ("\n" if trailing_newline else ""))
+    return path
+
+
+def get_rows(n, dim=3, seed=0):
+    rng = np.random.default_rng(seed)
+    # lines of different lengths, so that chunk offsets fall inside lines
+    return [(i, rng.standard_normal(dim).round(rng.integers(1, 8)).tolist()) for i in range(n)]
+
+
+@pytest.mark.parametrize("trailing_newline", [True, False])
+@pytest.mark.parametrize("n_chunks", [1, 2, 3, 7, 50, 500])
+def test_chunks_start_at_lines_and_count_all_lines(tmp_path, n_chunks, trailing_newline):
+    path = write_jsonl(tmp_path / "e.jsonl", get_rows(101), trailing_newline)
+    content = path.read_bytes()
+    chunks = _get_chunks([str(path)], n_chunks)
+
+    assert chunks[0][1] == 0 and chunks[-1][2] == len(content)
+    for (_, _, end), (_, start, _) in zip(chunks[:-1], chunks[1:]):
+        assert end == start
+        assert content[start - 1 : start] == b"\n"
+    assert sum(_count_lines(*chunk) for chunk in chunks) == 101
+
+
+def test_parallel_loading_matches_sequential(tmp_path):
+    path = str(write_jsonl(tmp_path / "e.jsonl", get_rows(1000, dim=8)))
+    expected = load_embeddings_from_jsonl(path, dtype=np.float32)
+    embeddings = load_embeddings_from_jsonl_parallel(path, n_jobs=2)
+    assert len(embeddings) == len(expected)
+    for paper_id, vector in expected.items():
+        np.testing.assert_array_equal(embeddings[paper_id], vector)
+
+
+def test_repeated_ids_keep_the_last_embedding(tmp_path):
+    rows = [(i % 3, [float(i), 1.0]) for i in range(5)]
+    path = str(write_jsonl(tmp_path / "e.jsonl", rows))
+    expected = load_embeddings_from_jsonl(path, dtype=np.float32)
+    embeddings = load_embeddings_from_jsonl_parallel(path, n_jobs=2)
+    assert len(embeddings) == len(expected) == 3
+    for paper_id, vector in expected.items():
+        np.testing.assert_array_equal(embeddings[paper_id], vector)
+
+
+def test_shared_matrix_falls_back_to_tmpdir(tmp_path, monkeypatch):
+    shm_dir = tmp_path / "shm"
+    shm_dir.mkdir()
+    posix_fallocate = os.posix_fallocate
+
+    def no_space(fd, offset, length):
+        if os.readlink(f"/proc/self/fd/{fd}").startswith(str(shm_dir)):
+            raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+        posix_fallocate(fd, offset, length)
+
+    monkeypatch.setattr(embeddings_module, "SHARED_MEMORY_DIR", str(shm_dir))
+    monkeypatch.setattr(os, "posix_fallocate", no_space)
+    with embeddings_module.create_shared_file(1 << 20) as f:
+        assert os.path.dirname(f.name) != str(shm_dir)
+        assert os.path.getsize(f.name) == 1 << 20
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from ru_sci_bench.embeddings import EmbeddingMatrix
+from ru_sci_bench.scheduler import run_tasks_in_workers
+
+
+def sum_task(task, embeddings, ids):
+    return {task: embeddings.take(ids).sum(axis=0).tolist()}
+
+
+@pytest.mark.parametrize("as_dict", [False, True])
+def test_workers_see_the_required_embeddings(as_dict):
+    rng = np.random.default_rng(0)
+    ids = np.arange(0, 200, 2)
+    vectors = rng.standard_normal((len(ids), 5)).astype(np.float32)
+    embeddings = EmbeddingMatrix(ids, vectors)
+    if as_dict:
+        embeddings = dict(zip(ids.tolist(), vectors))
+    paper_ids = ids[10:60]
+
+    results = list(
+        run_tasks_in_workers(sum_task, ["a", "b"], embeddings, paper_ids, 2, ids=paper_ids[::3])
+    )
+    expected = vectors[10:60][::3].sum(axis=0)
+    assert [task for task, _ in results] == ["a", "b"]
+    for task, result in results:
+        np.testing.assert_allclose(result[task], expected, rtol=1e-6)
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from ru_sci_bench.classification import bidirectional_translation_search
+from ru_sci_bench.search import csls_gold_pair_ranks, gold_pair_ranks, normalize_embeddings
+
+
+@pytest.mark.parametrize("fill", [0, 1])
+@pytest.mark.parametrize("out_of_core", [False, True])
+def test_degenerate_embeddings_are_not_ranked_first(fill, out_of_core):
+    n = 1000
+    x = np.full((n, 384), fill, dtype=np.float32)
+    if out_of_core:
+        x = normalize_embeddings(x)
+    ranks = csls_gold_pair_ranks(x, x.copy(), memory_budget=1 << 16, out_of_core=out_of_core)
+    for rank in ranks:
+        # as with argmax, only the first candidate is ranked first
+        assert np.mean(rank == 1) == pytest.approx(1 / n)
+
+
+def test_degenerate_embeddings_recall():
+    x = np.zeros((1000, 64), dtype=np.float32)
+    ru_en, en_ru = bidirectional_translation_search(x, x.copy())
+    assert ru_en["recall@1"] == pytest.approx(1e-3)
+    assert ru_en["csls_recall@1"] == pytest.approx(1e-3)
+    assert en_ru["mrr"] < 0.01
+
+
+def test_ties_are_broken_by_index():
+    rng = np.random.default_rng(0)
+    x = rng.integers(-1, 2, (300, 3)).astype(np.float32)
+    y = rng.integers(-1, 2, (300, 3)).astype(np.float32)
+    x_ranks, y_ranks = gold_pair_ranks(x, y, memory_budget=1 << 12)
+
+    similarities = normalize_embeddings(x).astype(np.float64) @ normalize_embeddings(y).T
+    gold = np.diag(similarities)[:, None]
+    index = np.arange(len(x))
+    x_better = (similarities > gold + 1e-6) | (
+        (np.abs(similarities - gold) <= 1e-6) & (index[None, :] < index[:, None])
+    )
+    y_better = (similarities > gold.T + 1e-6) | (
+        (np.abs(similarities - gold.T) <= 1e-6) & (index[:, None] < index[None, :])
+    )
+    np.testing.assert_array_equal(x_ranks, 1 + x_better.sum(axis=1))
+    np.testing.assert_array_equal(y_ranks, 1 + y_better.sum(axis=0))
+
+
+def test_half_precision_tiles_match_upcast_ranks():
+    rng = np.random.default_rng(0)
+    x = normalize_embeddings(rng.standard_normal((500, 32))).astype(np.float16)
+    y = normalize_embeddings(x + 0.5 * rng.standard_normal(x.shape)).astype(np.float16)
+    expected = csls_gold_pair_ranks(
+        x.astype(np.float32), y.astype(np.float32), memory_budget=1 << 14, out_of_core=True
+    )
+    ranks = csls_gold_pair_ranks(x, y, memory_budget=1 << 14, out_of_core=True)
+    for rank, expected_rank in zip(ranks, expected):
+        np.testing.assert_array_equal(rank, expected_rank)
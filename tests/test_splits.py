@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ru_sci_bench.splits import load_split
+
+
+@pytest.mark.parametrize(
+    "labels, dtype_kind",
+    [([3, 1, 2], "i"), (["physics", "math", "physics"], "U"), ([0.5, 1.0, 2.0], "f")],
+)
+def test_labels_are_compiled_and_memory_mapped(tmp_path, labels, dtype_kind):
+    path = tmp_path / "split.csv"
+    pd.DataFrame({"id": [10, 200000, 30], "label": labels}).to_csv(path, index=False)
+    cache_path = str(tmp_path / "cache")
+
+    compiled = load_split(str(path), cache_path)
+    loaded = load_split(str(path), cache_path)
+    assert isinstance(loaded["labels"], np.memmap)
+    assert loaded["ids"].dtype == np.int32
+    assert loaded["labels"].dtype.kind == dtype_kind
+    for split in [compiled, loaded]:
+        np.testing.assert_array_equal(split["ids"], [10, 200000, 30])
+        assert split["labels"].tolist() == labels